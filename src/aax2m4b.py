@@ -12,6 +12,8 @@ There can be only one.
 import this :-)
 """
 
+import multiprocessing
+
 import wx
 
 from ivonet.events import dbg
@@ -45,4 +47,6 @@ def main():
 
 
 if __name__ == '__main__':
+    # the spawned worker processes (brute force) must not start the app again in the frozen bundle
+    multiprocessing.freeze_support()
     main()
@@ -22,9 +22,7 @@ APP_RCRACK = f'{RESOURCE}/rcrack'
 APP_MP3_BINDER = f'{RESOURCE}/mp3binder'
 APP_FFMPEG = f'{RESOURCE}/ffmpeg'
 APP_FFPROBE = f'{RESOURCE}/ffprobe'
-APP_ATOMIC_PARSLEY = f"{RESOURCE}/AtomicParsley"
 APP_MP4_CHAPS = f'{RESOURCE}/mp4chaps'
-APP_MP4_ART = f"{RESOURCE}/mp4art"
 if not os.path.isfile(APP_RCRACK):
     raise IOError("rcrack not found. Are you sure you copied it to the resource folder? See the README.md")
 if not os.path.isfile(APP_MP3_BINDER):
@@ -33,14 +31,14 @@ if not os.path.isfile(APP_FFMPEG):
     raise IOError("ffmpeg not found. Are you sure you copied it to the resource folder? See the README.md")
 if not os.path.isfile(APP_FFPROBE):
     raise IOError("ffprobe not found. Are you sure you copied it to the resource folder? See the README.md")
-if not os.path.isfile(APP_ATOMIC_PARSLEY):
-    raise IOError("AtomicParsley not found. Are you sure you copied it to the resource folder? See the README.md")
 if not os.path.isfile(APP_MP4_CHAPS):
     raise IOError("mp4chaps not found. Are you sure you copied it to the resource folder? See the README.md")
-if not os.path.isfile(APP_MP4_ART):
-    raise IOError("mp4art not found. Are you sure you copied it to the resource folder? See the README.md")
 
 RAINBOW_FILES = [os.path.join(RESOURCE, x) for x in os.listdir(RESOURCE) if x.lower().endswith(".rt")]
+# Maximum number of rainbow tables searched at the same time
+RAINBOW_CONCURRENCY = max(1, min(len(RAINBOW_FILES), os.cpu_count() or 1))
+# Brute force the activation bytes when no rainbow table matches (can take a long time)
+BRUTE_FORCE = os.environ.get("BRUTE_FORCE", "").strip().lower() in ("1", "true", "yes", "on")
 
 SETTINGS_DIRECTORY = data_directory(TXT_APP_NAME)
 if not os.path.isdir(SETTINGS_DIRECTORY):
@@ -56,8 +54,25 @@ if not os.path.isdir(DEFAULT_SAVE_PATH):
 if not os.path.isdir(DEFAULT_SAVE_PATH):
     DEFAULT_SAVE_PATH = "/"
 
+# Conversion modes
+CONVERSION_MODE_REMUX = "remux"  # lossless stream copy of the audio
+CONVERSION_MODE_TRANSCODE = "transcode"  # re-encode the audio to AAC
+CONVERSION_MODES = [CONVERSION_MODE_REMUX, CONVERSION_MODE_TRANSCODE]
+DEFAULT_CONVERSION_MODE = CONVERSION_MODE_REMUX
+TRANSCODE_BITRATE = "64k"
+# Maximum number of segments transcoded at the same time
+TRANSCODE_CONCURRENCY = os.cpu_count() or 1
+# Number of processes decrypting sample ranges of one (large) aax at the same time
+DECRYPT_CONCURRENCY = os.cpu_count() or 1
+# Free space reserved after the tags so they can be changed later without rewriting the whole file
+TAG_PADDING = 64 * 1024
+
 SETTINGS_FILE = os.path.join(SETTINGS_DIRECTORY, f"{TXT_APP_NAME}.ini")
 LOG_FILE = os.path.join(SETTINGS_DIRECTORY, f"{TXT_APP_NAME}.log")
+ACTIVATION_BYTES_DB = os.path.join(SETTINGS_DIRECTORY, "activation_bytes.db")
+RAINBOW_SOCKET = os.path.join(SETTINGS_DIRECTORY, "rainbow.sock")
+PROBE_CACHE_DB = os.path.join(SETTINGS_DIRECTORY, "probe.db")
+PROBE_CACHE_SIZE = 5000  # maximum number of cached probe results
 
 try:
     VERSION = open(os.path.join(RESOURCE, "VERSION"), "r").read().strip()
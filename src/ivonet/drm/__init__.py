@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-15 20:12:41$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """ ivonet.drm package
+
+Everything needed to recover the activation bytes of an aax file
+"""
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-16 19:40:02$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+The aax key derivation as done by ffmpeg (libavformat/mov.c mov_read_adrm).
+
+The checksum in the adrm atom is a SHA-1 over a key and iv derived from the activation bytes.
+This means that a candidate for the activation bytes can be verified without decrypting anything.
+
+Decrypting the file key from the drm blob needs AES (pycryptodome).
+"""
+
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+FIXED_KEY = bytes.fromhex("77214d4b196a87cd520045fd20a51d67")
+
+
+def _to_bytes(activation_bytes) -> bytes:
+    if isinstance(activation_bytes, str):
+        return bytes.fromhex(activation_bytes.strip())
+    return bytes(activation_bytes)
+
+
+def derive(activation_bytes) -> tuple:
+    """derive(activation_bytes) -> (intermediate_key, intermediate_iv) both 20 bytes long"""
+    ab = _to_bytes(activation_bytes)
+    intermediate_key = hashlib.sha1(FIXED_KEY + ab).digest()
+    intermediate_iv = hashlib.sha1(FIXED_KEY + intermediate_key + ab).digest()
+    return intermediate_key, intermediate_iv
+
+
+def calculate_checksum(activation_bytes) -> bytes:
+    """calculate_checksum(activation_bytes) -> the checksum an aax file encrypted with these bytes will have"""
+    intermediate_key, intermediate_iv = derive(activation_bytes)
+    return hashlib.sha1(intermediate_key[:16] + intermediate_iv[:16]).digest()
+
+
+if numpy is not None:
+    U32 = numpy.uint32
+    SHA1_INIT = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0)
+    FIXED_KEY_WORDS = [int.from_bytes(FIXED_KEY[i:i + 4], "big") for i in range(0, 16, 4)]
+
+    def _rotl(x, n):
+        return (x << U32(n)) | (x >> U32(32 - n))
+
+    def _sha1_block(words, size):
+        """SHA-1 of one padded 64 byte block for a whole array of messages at once"""
+        w = [numpy.full(size, x, dtype=U32) if isinstance(x, int) else x for x in words]
+        for t in range(16, 80):
+            w.append(_rotl(w[t - 3] ^ w[t - 8] ^ w[t - 14] ^ w[t - 16], 1))
+        a, b, c, d, e = (numpy.full(size, x, dtype=U32) for x in SHA1_INIT)
+        for t in range(80):
+            if t < 20:
+                f = (b & c) | (~b & d)
+                k = U32(0x5A827999)
+            elif t < 40:
+                f = b ^ c ^ d
+                k = U32(0x6ED9EBA1)
+            elif t < 60:
+                f = (b & c) | (b & d) | (c & d)
+                k = U32(0x8F1BBCDC)
+            else:
+                f = b ^ c ^ d
+                k = U32(0xCA62C1D6)
+            temp = _rotl(a, 5) + f + e + k + w[t]
+            e, d, c, b, a = d, c, _rotl(b, 30), a, temp
+        return [U32(h) + x for h, x in zip(SHA1_INIT, (a, b, c, d, e))]
+
+
+def calculate_checksums(activation_bytes) -> list:
+    """calculate_checksums(activation_bytes) -> the checksums for a whole array of activation bytes at once
+
+    activation_bytes is a numpy uint32 array (big endian value of the 4 bytes).
+    Returns the 5 big endian words of the SHA-1 checksums as uint32 arrays.
+    """
+    if numpy is None:
+        raise ImportError("numpy is needed to calculate checksums in bulk")
+    size = len(activation_bytes)
+    with numpy.errstate(over="ignore"):
+        key = _sha1_block(FIXED_KEY_WORDS + [activation_bytes, 0x80000000] + [0] * 9 + [160], size)
+        iv = _sha1_block(FIXED_KEY_WORDS + key + [activation_bytes, 0x80000000] + [0] * 4 + [320], size)
+        return _sha1_block(key[:4] + iv[:4] + [0x80000000] + [0] * 6 + [256], size)
+
+
+def verify(checksum: str, activation_bytes) -> bool:
+    """verify(checksum, activation_bytes) -> True if the activation bytes belong to the aax checksum"""
+    if not checksum or not activation_bytes:
+        return False
+    try:
+        return calculate_checksum(activation_bytes) == bytes.fromhex(checksum.strip())
+    except ValueError:
+        return False
+
+
+def can_decrypt() -> bool:
+    """can_decrypt() -> True if AES is available for in process decryption"""
+    return AES is not None
+
+
+def file_key(activation_bytes, blob: bytes) -> tuple:
+    """file_key(activation_bytes, blob) -> (key, iv) to decrypt the samples with (AES-128-CBC per sample)
+
+    Raises ValueError if the activation bytes do not belong to the drm blob.
+    """
+    if AES is None:
+        raise ImportError("pycryptodome is needed to decrypt aax files in process")
+    ab = _to_bytes(activation_bytes)
+    intermediate_key, intermediate_iv = derive(ab)
+    output = AES.new(intermediate_key[:16], AES.MODE_CBC, intermediate_iv[:16]).decrypt(bytes(blob[:48]))
+    # the activation bytes are stored big endian in the blob
+    if output[3::-1] != ab:
+        raise ValueError("The activation bytes do not match the drm blob")
+    key = output[8:24]
+    iv = hashlib.sha1(output[26:42] + key + FIXED_KEY).digest()[:16]
+    return key, iv
+
+
+def find(checksum: str, candidates):
+    """find(checksum, candidates) -> the first candidate activation bytes matching the checksum or None"""
+    for candidate in candidates:
+        if verify(checksum, candidate):
+            return candidate
+    return None
+
+
+__all__ = [
+    "FIXED_KEY",
+    "derive",
+    "calculate_checksum",
+    "calculate_checksums",
+    "verify",
+    "find",
+    "can_decrypt",
+    "file_key",
+]
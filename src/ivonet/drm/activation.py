@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-15 20:12:41$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Persistent store of recovered activation bytes keyed by the aax checksum.
+
+One Audible account uses the same activation bytes for every book, so once they
+are found there is no need to start a rainbow table search again.
+The store is a small SQLite database in the settings directory. SQLite does its own
+file locking, so it can be shared by all the worker threads and by multiple running
+instances of the application.
+"""
+
+import sqlite3
+from contextlib import closing
+
+import ivonet
+
+TIMEOUT = 30  # seconds to wait for a lock held by another thread or process
+
+
+def _connect():
+    conn = sqlite3.connect(ivonet.ACTIVATION_BYTES_DB, timeout=TIMEOUT)
+    conn.execute("""CREATE TABLE IF NOT EXISTS activation_bytes (
+                        checksum TEXT PRIMARY KEY,
+                        activation_bytes TEXT NOT NULL,
+                        created TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    return conn
+
+
+def _normalize(value: str) -> str:
+    return value.strip().lower()
+
+
+def lookup(checksum: str):
+    """lookup(checksum) -> the known activation bytes for the checksum or None"""
+    if not checksum:
+        return None
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT activation_bytes FROM activation_bytes WHERE checksum = ?",
+                           (_normalize(checksum),)).fetchone()
+    return row[0] if row else None
+
+
+def store(checksum: str, activation_bytes: str):
+    """store(checksum, activation_bytes) -> remembers the activation bytes for the checksum"""
+    if not checksum or not activation_bytes:
+        return
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO activation_bytes (checksum, activation_bytes) VALUES (?, ?)",
+                     (_normalize(checksum), _normalize(activation_bytes)))
+
+
+def history() -> list:
+    """history() -> all distinct activation bytes ever recovered, most recently used first"""
+    with closing(_connect()) as conn:
+        rows = conn.execute("""SELECT activation_bytes FROM activation_bytes
+                               GROUP BY activation_bytes
+                               ORDER BY MAX(created) DESC""").fetchall()
+    return [row[0] for row in rows]
+
+
+__all__ = [
+    "lookup",
+    "store",
+    "history",
+]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-20 15:12:44$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Brute force search of the activation bytes when no rainbow table has a match.
+
+The activation bytes are only 4 bytes long so the whole key space is 2^32 candidates.
+The key space is split in chunks that are checked against the checksum in a process pool.
+Finished chunks are written to a checkpoint file in the settings directory, so a cancelled
+search continues where it stopped the next time the book is converted.
+The worker processes are spawned (not forked from the threaded gui); the frozen app needs
+multiprocessing.freeze_support() in its entry point for that (see aax2m4b.py).
+
+With numpy the candidates of a batch are checked vectorized, otherwise one by one with hashlib.
+"""
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import ivonet
+from ivonet.drm import aax
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KEY_SPACE = 0x100000000
+CHUNK_SIZE = 0x100000  # candidates per task
+BATCH_SIZE = 0x10000  # candidates per vectorized check
+POLL_INTERVAL = 0.5
+
+
+def _search_chunk(checksum: bytes, start: int, end: int):
+    """_search_chunk(checksum, start, end) -> the activation bytes in [start, end) matching the checksum or None"""
+    if numpy is None:
+        for candidate in range(start, end):
+            if aax.calculate_checksum(candidate.to_bytes(4, "big")) == checksum:
+                return candidate.to_bytes(4, "big").hex()
+        return None
+    target = [int.from_bytes(checksum[i:i + 4], "big") for i in range(0, 20, 4)]
+    for batch in range(start, end, BATCH_SIZE):
+        candidates = numpy.arange(batch, min(batch + BATCH_SIZE, end), dtype=numpy.uint32)
+        words = aax.calculate_checksums(candidates)
+        match = words[0] == target[0]
+        for word, expected in zip(words[1:], target[1:]):
+            match &= word == expected
+        hits = numpy.nonzero(match)[0]
+        if len(hits):
+            return int(candidates[hits[0]]).to_bytes(4, "big").hex()
+    return None
+
+
+def checkpoint_file(checksum: str) -> str:
+    return os.path.join(ivonet.SETTINGS_DIRECTORY, f"bruteforce-{checksum.strip().lower()}.json")
+
+
+def _load_checkpoint(checksum: str) -> set:
+    try:
+        with open(checkpoint_file(checksum), "r") as fi:
+            return set(json.load(fi))
+    except (IOError, ValueError):
+        return set()
+
+
+def _save_checkpoint(checksum: str, done: set):
+    filename = checkpoint_file(checksum)
+    with open(filename + ".tmp", "w") as fo:
+        json.dump(sorted(done), fo)
+    os.replace(filename + ".tmp", filename)
+
+
+def _remove_checkpoint(checksum: str):
+    try:
+        os.remove(checkpoint_file(checksum))
+    except IOError:
+        pass
+
+
+def search(checksum: str, progress=None, cancelled=None, workers=None):
+    """search(checksum, progress, cancelled, workers) -> the activation bytes or None
+
+    progress is an optional callable receiving the percentage of the key space searched.
+    cancelled is an optional callable that stops the search when it returns True.
+    workers is the size of the process pool (default the number of cpu's).
+    """
+    digest = bytes.fromhex(checksum.strip())
+    chunks = KEY_SPACE // CHUNK_SIZE
+    done = _load_checkpoint(checksum)
+    todo = [chunk for chunk in range(chunks) if chunk not in done]
+    ret = None
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        running = {}
+        while (todo or running) and not ret:
+            if cancelled and cancelled():
+                break
+            while todo and len(running) < workers * 2:
+                chunk = todo.pop(0)
+                start = chunk * CHUNK_SIZE
+                running[executor.submit(_search_chunk, digest, start, start + CHUNK_SIZE)] = chunk
+            finished, _ = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done.add(running.pop(future))
+                ret = ret or future.result()
+            if finished:
+                _save_checkpoint(checksum, done)
+                if progress:
+                    progress(len(done) * 100 / chunks)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if ret or len(done) == chunks:
+        _remove_checkpoint(checksum)
+    return ret
+
+
+__all__ = [
+    "search",
+    "checkpoint_file",
+]
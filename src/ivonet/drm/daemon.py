@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-18 20:31:17$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Shared rainbow table lookup service over a Unix domain socket.
+
+The daemon opens the rainbow tables once and keeps them resident, so concurrent conversions
+and multiple instances of the application on one host do not each load the same tables.
+Requests that arrive close together are walked as one batch and identical checksums that
+are already being searched for wait for that search instead of starting a new one.
+The tables are searched with the in process engine (see ivonet.drm.rainbow), which is a lot
+slower than rcrack, so the application only asks the daemon when rcrack can not be run.
+
+Protocol (one line per message):
+    client: <checksum>
+    daemon: <activation bytes> | notfound | error
+
+An error answer means the tables could not be searched; the client should search them itself.
+
+Start the daemon with:
+    python -m ivonet.drm.daemon
+"""
+
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+
+import ivonet
+from ivonet.drm import rainbow
+
+BATCH_WINDOW = 0.05  # seconds to wait for more requests before a batch is walked
+NOT_FOUND = "notfound"
+ERROR = "error"
+POLL_INTERVAL = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def rt_files() -> list:
+    """rt_files() -> the rainbow tables the daemon can serve"""
+    return [rt_file for rt_file in ivonet.RAINBOW_FILES if rainbow.supports(rt_file)]
+
+
+class LookupHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            checksum = line.decode("ascii", "ignore").strip().lower()
+            if not checksum:
+                continue
+            future = self.server.lookup(checksum)
+            ret = ERROR if future.exception() else future.result() or NOT_FOUND
+            self.wfile.write(f"{ret}\n".encode("ascii"))
+            self.wfile.flush()
+
+
+class LookupServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, tables) -> None:
+        super().__init__(socket_path, LookupHandler)
+        self.tables = tables
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        for rt_file in self.tables:
+            rainbow.table(rt_file)
+        threading.Thread(target=self.batcher, daemon=True).start()
+
+    def lookup(self, checksum) -> Future:
+        """lookup(checksum) -> future with the activation bytes. Identical in flight checksums share one future"""
+        with self.lock:
+            if checksum not in self.in_flight:
+                self.in_flight[checksum] = Future()
+                self.requests.put(checksum)
+            return self.in_flight[checksum]
+
+    def batcher(self):
+        while True:
+            batch = [self.requests.get()]
+            time.sleep(BATCH_WINDOW)
+            while not self.requests.empty():
+                batch.append(self.requests.get())
+            try:
+                found = rainbow.lookup_many(batch, self.tables)
+                error = None
+            except Exception as e:
+                logger.exception("Lookup of %d checksums failed", len(batch))
+                found, error = {}, e
+            with self.lock:
+                for checksum in batch:
+                    future = self.in_flight.pop(checksum)
+                    if error:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(found.get(checksum))
+
+
+def available(socket_path=None) -> bool:
+    """available() -> True if a daemon is listening on the socket"""
+    socket_path = socket_path or ivonet.RAINBOW_SOCKET
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def lookup(checksum: str, cancelled=None, socket_path=None):
+    """lookup(checksum, cancelled) -> the activation bytes or None
+
+    Raises OSError when the daemon can not be reached or could not search its tables.
+    cancelled is an optional callable that stops waiting for the answer when it returns True.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or ivonet.RAINBOW_SOCKET)
+        sock.sendall(f"{checksum.strip()}\n".encode("ascii"))
+        sock.settimeout(POLL_INTERVAL)
+        answer = b""
+        while not answer.endswith(b"\n"):
+            if cancelled and cancelled():
+                return None
+            try:
+                data = sock.recv(128)
+            except socket.timeout:
+                continue
+            if not data:
+                raise ConnectionError("Rainbow table daemon closed the connection")
+            answer += data
+    ret = answer.decode("ascii").strip()
+    if ret == ERROR:
+        raise OSError("Rainbow table daemon could not search its tables")
+    return None if ret == NOT_FOUND else ret
+
+
+def serve(socket_path=None):
+    socket_path = socket_path or ivonet.RAINBOW_SOCKET
+    tables = rt_files()
+    if not tables:
+        raise IOError("No rainbow tables can be served. Is numpy installed?")
+    if os.path.exists(socket_path):
+        if available(socket_path):
+            raise IOError(f"Rainbow table daemon already running on: {socket_path}")
+        os.remove(socket_path)
+    with LookupServer(socket_path, tables) as server:
+        logger.info("Serving %d rainbow tables on: %s", len(tables), socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        serve()
+    except KeyboardInterrupt:
+        pass
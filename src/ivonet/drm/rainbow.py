@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-17 21:03:55$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+In process rainbow table lookup for the audible tables (RainbowCrack-NG .rt format).
+
+The tables are memory mapped once and kept open, so the multi-GB files are not read and
+parsed again for every book. A .rt file is an array of (start index, end index) chains of
+two little endian uint64 values sorted on the end index.
+
+The table parameters are taken from the filename like RainbowCrack does:
+    audible_byte#4-4_<table index>_<chain length>x<chain count>_<part>.rt
+
+The chain walking is vectorized with NumPy. Without NumPy the tables are not supported.
+The hashing is no faster than plain hashlib (~0.2M hash-reduce steps a second), so a lookup
+takes minutes per table and native rcrack is much faster: rcrack stays the primary search and this
+engine is only the fallback for when rcrack can not be run.
+"""
+
+import mmap
+import os
+import re
+import threading
+
+from ivonet.drm import aax
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TABLE_NAME = re.compile(r"^audible_byte#4-4_(?P<index>\d+)_(?P<length>\d+)x(?P<count>\d+)_\d+\.rt$", re.IGNORECASE)
+CHAIN_SIZE = 16
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def supports(rt_file) -> bool:
+    """supports(rt_file) -> True if the table can be searched in process"""
+    return numpy is not None and TABLE_NAME.match(os.path.basename(rt_file)) is not None
+
+
+def _reduce(checksum: bytes, offset: int, position: int) -> int:
+    """RainbowCrack HashToIndex for a plain space of 2^32"""
+    return (int.from_bytes(checksum[:8], "little") + offset + position) % 0x100000000
+
+
+def _plain(index: int) -> bytes:
+    """RainbowCrack IndexToPlain for the byte#4-4 charset"""
+    return index.to_bytes(4, "big")
+
+
+if numpy is not None:
+    U32 = numpy.uint32
+
+    def _hash_reduce(indexes, offset, position):
+        """The audible hash of every index followed by the RainbowCrack reduction"""
+        checksum = aax.calculate_checksums(indexes)
+        # the low 32 bits of the little endian uint64 at the start of the digest
+        return checksum[0].byteswap() + U32((offset + position) % 0x100000000)
+
+
+class RainbowTable(object):
+    def __init__(self, rt_file) -> None:
+        match = TABLE_NAME.match(os.path.basename(rt_file))
+        if not match:
+            raise ValueError(f"Not a supported rainbow table: {rt_file}")
+        self.rt_file = rt_file
+        self.chain_length = int(match.group("length"))
+        self.reduce_offset = 65536 * int(match.group("index"))
+        with open(rt_file, "rb") as fi:
+            self.mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        chains = numpy.frombuffer(self.mm, dtype=numpy.dtype([("start", "<u8"), ("end", "<u8")]),
+                                  count=len(self.mm) // CHAIN_SIZE)
+        self.starts = chains["start"]
+        self.ends = chains["end"]
+
+    def lookup(self, checksum: bytes, cancelled=None):
+        """lookup(checksum, cancelled) -> the activation bytes or None
+
+        cancelled is an optional callable that stops the search when it returns True.
+        """
+        return self.lookup_many([checksum], cancelled).get(checksum)
+
+    def lookup_many(self, checksums: list, cancelled=None) -> dict:
+        """lookup_many(checksums, cancelled) -> {checksum: activation bytes} for all the checksums found
+
+        Walks the chains from every possible position of every checksum to their end points at once
+        and then verifies the chains whose end point is in the table.
+        """
+        length = self.chain_length
+        ret = {}
+        with numpy.errstate(over="ignore"):
+            lanes = numpy.array([[_reduce(checksum, self.reduce_offset, pos) for pos in range(length - 1)]
+                                 for checksum in checksums], dtype=U32)
+            for pos in range(1, length - 1):
+                if cancelled and cancelled():
+                    return ret
+                lanes[:, :pos] = _hash_reduce(lanes[:, :pos].ravel(), self.reduce_offset, pos).reshape(-1, pos)
+
+            for checksum, ends in zip(checksums, lanes):
+                found = numpy.searchsorted(self.ends, ends.astype(numpy.uint64))
+                found[found == len(self.ends)] = 0
+                for position in numpy.nonzero(self.ends[found] == ends)[0]:
+                    chain = found[position]
+                    while checksum not in ret and chain < len(self.ends) and self.ends[chain] == ends[position]:
+                        activation_bytes = self.check_alarm(int(self.starts[chain]), int(position), checksum)
+                        if activation_bytes:
+                            ret[checksum] = activation_bytes
+                        chain += 1
+        return ret
+
+    def check_alarm(self, index: int, position: int, checksum: bytes):
+        """Regenerates the chain up to the guessed position to rule out a false alarm"""
+        for pos in range(position):
+            index = _reduce(aax.calculate_checksum(_plain(index)), self.reduce_offset, pos)
+        if aax.calculate_checksum(_plain(index)) == checksum:
+            return _plain(index).hex()
+        return None
+
+    def close(self):
+        self.starts = self.ends = None
+        self.mm.close()
+
+
+def table(rt_file) -> RainbowTable:
+    """table(rt_file) -> the opened table. Tables are opened once and stay resident."""
+    with _tables_lock:
+        if rt_file not in _tables:
+            _tables[rt_file] = RainbowTable(rt_file)
+        return _tables[rt_file]
+
+
+def lookup(checksum: str, rt_files, cancelled=None):
+    """lookup(checksum, rt_files, cancelled) -> the activation bytes as hex string or None
+
+    Raises ValueError if one of the tables is not supported. Use supports() first.
+    """
+    return lookup_many([checksum], rt_files, cancelled).get(checksum)
+
+
+def lookup_many(checksums: list, rt_files, cancelled=None) -> dict:
+    """lookup_many(checksums, rt_files, cancelled) -> {checksum: activation bytes} for all the checksums found
+
+    All the checksums are walked together, so a batch costs hardly more than a single lookup.
+    """
+    digests = {bytes.fromhex(checksum.strip()): checksum for checksum in checksums}
+    ret = {}
+    for rt_file in rt_files:
+        todo = [digest for digest in digests if digests[digest] not in ret]
+        if not todo:
+            break
+        for digest, activation_bytes in table(rt_file).lookup_many(todo, cancelled).items():
+            ret[digests[digest]] = activation_bytes
+    return ret
+
+
+__all__ = [
+    "supports",
+    "lookup",
+    "lookup_many",
+    "table",
+    "RainbowTable",
+]
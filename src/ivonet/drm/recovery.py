@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-19 21:47:08$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Process wide single flight of the activation bytes recovery.
+
+When a lot of books of the same account are queued at once only one of them searches
+the rainbow tables. Jobs with the same checksum wait for that search. Jobs with another
+checksum also wait for it, because the recovered activation bytes will most likely
+belong to their book too. That is verified with the checksum before they are used.
+Only when no running search helps a job will it start a search of its own.
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from ivonet.drm import aax
+
+POLL_INTERVAL = 0.5  # seconds between checks for cancellation while waiting
+
+_lock = threading.Lock()
+_in_flight = {}
+
+
+def recover(checksum: str, search, cancelled=None):
+    """recover(checksum, search, cancelled) -> the activation bytes or None
+
+    search is the callable doing the actual recovery: search(checksum) -> activation bytes or None
+    cancelled is an optional callable that stops waiting when it returns True.
+    """
+    checked = set()
+    while True:
+        if cancelled and cancelled():
+            return None
+        with _lock:
+            future = _in_flight.get(checksum)
+            others = [f for f in _in_flight.values() if f not in checked]
+            if future is None and not others:
+                future = _in_flight[checksum] = Future()
+                break
+        if future is not None:
+            if _wait([future], cancelled) and not future.cancelled():
+                return future.result()
+            continue
+        for done in _wait(others, cancelled):
+            checked.add(done)
+            if not done.cancelled() and done.exception() is None and aax.verify(checksum, done.result()):
+                return done.result()
+
+    try:
+        ret = search(checksum)
+        if ret is None and cancelled and cancelled():
+            # let the waiting jobs try again themselves
+            future.cancel()
+        else:
+            future.set_result(ret)
+        return ret
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            del _in_flight[checksum]
+
+
+def _wait(futures, cancelled) -> set:
+    """_wait(futures, cancelled) -> the done futures. Empty when cancelled."""
+    while True:
+        done, _ = wait(futures, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        if done:
+            return done
+        if cancelled and cancelled():
+            return set()
+
+
+__all__ = [
+    "recover",
+]
@@ -15,20 +15,26 @@ import wx
 import wx.lib.newevent
 from wx._core import CommandEvent
 
+import ivonet
 from ivonet.events import log, dbg
 from ivonet.events.custom import EVT_PROCESS_DONE, EVT_PROCESS_ERROR, ProcessExceptionEvent, ProcessCleanEvent, \
     ProcessCancelledEvent
+from ivonet.threading.JobScheduler import estimate_cost
 from ivonet.threading.ProjectConverterWorker import ProjectConverterWorker
 
 
 class AudiobookEntry(wx.Panel):
-    def __init__(self, parent, project: str, panel_id=wx.ID_ANY):
+    def __init__(self, parent, project: str, mode=ivonet.DEFAULT_CONVERSION_MODE, panel_id=wx.ID_ANY):
         wx.Panel.__init__(self, parent.queue_window, panel_id, style=wx.BORDER_SIMPLE)
         self.parent = parent
         self.start_time = time.perf_counter()
         self.stage = 0  # used for the progressbar based on the different conversion stages
         self.project = project
+        self.mode = mode
         self.running = False
+        self.priority = 0  # higher goes first (see JobScheduler)
+        self.cost = estimate_cost(project)
+        self.path = project  # the scheduler tunes its pools for the storage of the book
 
         base_dir, filename = os.path.split(self.project)
         audiobook_name = filename.lower().replace(".aax", ".m4b")
@@ -39,15 +45,30 @@ class AudiobookEntry(wx.Panel):
         self.filename = wx.StaticText(self, wx.ID_ANY, audiobook_name)
         sizer.Add(self.filename, 5, wx.ALIGN_CENTER_VERTICAL, 0)
 
-        self.elapsed = wx.StaticText(self, wx.ID_ANY, "00:00:00")
+        self.mode_label = wx.StaticText(self, wx.ID_ANY, self.mode)
+        sizer.Add(self.mode_label, 1, wx.ALIGN_CENTER_VERTICAL, 0)
+
+        self.elapsed = wx.StaticText(self, wx.ID_ANY, "queued")
         sizer.Add(self.elapsed, 1, wx.ALIGN_CENTER_VERTICAL, 0)
 
         self.refresh_timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.on_time_indicator, self.refresh_timer)
 
-        self.progress = wx.Gauge(self, wx.ID_ANY, range=900, size=(300, 21), style=wx.GA_HORIZONTAL | wx.GA_SMOOTH)
+        self.progress = wx.Gauge(self, wx.ID_ANY, range=500, size=(300, 21), style=wx.GA_HORIZONTAL | wx.GA_SMOOTH)
         sizer.Add(self.progress, 3, wx.ALIGN_CENTER_VERTICAL, 0)
 
+        self.up_button = wx.Button(self, wx.ID_ANY, "▲")
+        self.up_button.SetMinSize((24, 24))
+        self.up_button.SetToolTip("Start earlier")
+        sizer.Add(self.up_button, 0, wx.EXPAND, 0)
+        self.Bind(wx.EVT_BUTTON, self.on_earlier, self.up_button)
+
+        self.down_button = wx.Button(self, wx.ID_ANY, "▼")
+        self.down_button.SetMinSize((24, 24))
+        self.down_button.SetToolTip("Start later")
+        sizer.Add(self.down_button, 0, wx.EXPAND, 0)
+        self.Bind(wx.EVT_BUTTON, self.on_later, self.down_button)
+
         self.stop_button = wx.Button(self, wx.ID_ANY, "x")
         self.stop_button.SetMinSize((24, 24))
         sizer.Add(self.stop_button, 0, wx.EXPAND, 0)
@@ -59,10 +80,16 @@ class AudiobookEntry(wx.Panel):
         self.SetSizer(sizer)
 
         self.Layout()
-        self.process = ProjectConverterWorker(self, self.project)
+        self.process = ProjectConverterWorker(self, self.project, self.mode, parent.scheduler)
 
     def start(self):
+        """Called by the scheduler when it is this books turn"""
+        self.start_time = time.perf_counter()
+        self.elapsed.SetLabel("00:00:00")
         self.refresh_timer.Start(1000)
+        self.up_button.Hide()
+        self.down_button.Hide()
+        self.Layout()
         self.process.start()
         self.running = True
 
@@ -84,6 +111,14 @@ class AudiobookEntry(wx.Panel):
             wx.PostEvent(self.parent, ProcessCleanEvent(obj=self))
         event.StopPropagation()
 
+    def on_earlier(self, event):
+        self.parent.move_in_queue(self, -1)
+        event.Skip()
+
+    def on_later(self, event):
+        self.parent.move_in_queue(self, 1)
+        event.Skip()
+
     def on_done(self, event):
         self.stop()
         self.filename.SetForegroundColour(wx.GREEN)
@@ -96,6 +131,7 @@ class AudiobookEntry(wx.Panel):
         self.filename.SetForegroundColour(wx.RED)
         self.Refresh()
         self.stop()
+        self.parent.remove_from_active_queue(self)
 
     def on_time_indicator(self, event):
         self.elapsed.SetLabel(time.strftime("%H:%M:%S", time.gmtime(time.perf_counter() - self.start_time)))
@@ -22,9 +22,11 @@ from ivonet.events.custom import EVT_PROCESS_CLEAN, ProcessCleanEvent, \
     EVT_PROCESS_CANCELLED, ProcessCancelledEvent
 from ivonet.gui.AudiobookEntryPanel import AudiobookEntry
 from ivonet.gui.MP3DropTarget import MP3DropTarget
-from ivonet.gui.MenuBar import MenuBar, FILE_MENU_QUEUE
+from ivonet.gui.MenuBar import MenuBar, FILE_MENU_QUEUE, CONVERSION_MENU_REMUX, CONVERSION_MENU_TRANSCODE, \
+    CONVERSION_MENU_SHORTEST_FIRST
 from ivonet.image.IvoNetArtProvider import IvoNetArtProvider
 from ivonet.model.Project import Project
+from ivonet.threading.JobScheduler import JobScheduler, POLICIES, POLICY_FIFO, POLICY_SJF
 
 try:
     from ivonet.image.images import yoda, pixel
@@ -48,6 +50,9 @@ class MainFrame(wx.Frame):
         #  Startup Settings
         self.activation_bytes = None
         self.active_queue = []
+        self.conversion_mode = ivonet.DEFAULT_CONVERSION_MODE
+        self.max_concurrent_jobs = 0  # 0 is auto tuned
+        self.scheduler = JobScheduler()
         self.genre_pristine = True
         self.project = Project()
         self.default_save_path = ivonet.DEFAULT_SAVE_PATH
@@ -127,6 +132,8 @@ class MainFrame(wx.Frame):
         vs_main.SetSizeHints(self)
 
         self.load_settings()
+        self.GetMenuBar().Check(self.conversion_mode_menu_id(), True)
+        self.GetMenuBar().Check(CONVERSION_MENU_SHORTEST_FIRST, self.scheduler.policy == POLICY_SJF)
         self.Layout()
 
         self.update_timer = wx.Timer(self)
@@ -191,6 +198,10 @@ class MainFrame(wx.Frame):
                                   wx.ICON_EXCLAMATION | wx.YES_NO) as dlg:
                 if dlg.ShowModal() == wx.ID_NO:
                     return
+        # the runs are not daemon threads so the conversions must stop or the exit waits for them
+        for book in list(self.active_queue):
+            book.stop()
+        self.scheduler.shutdown()
 
         self.save_settings()
         self.Close(True)
@@ -223,17 +234,50 @@ class MainFrame(wx.Frame):
         self.on_clear(event)
         event.Skip()
 
+    def on_conversion_mode(self, event):
+        """Handles the Conversion menu radio items"""
+        if event.GetId() == CONVERSION_MENU_TRANSCODE:
+            self.conversion_mode = ivonet.CONVERSION_MODE_TRANSCODE
+        else:
+            self.conversion_mode = ivonet.CONVERSION_MODE_REMUX
+        self.status(f"Conversion mode: {self.conversion_mode}")
+        event.Skip()
+
+    def on_queue_policy(self, event):
+        """Handles the Shortest book first menu item"""
+        self.scheduler.set_policy(POLICY_SJF if event.IsChecked() else POLICY_FIFO)
+        self.layout_queue()
+        self.status(f"Queue order: {self.scheduler.policy}")
+        event.Skip()
+
+    def conversion_mode_menu_id(self):
+        if self.conversion_mode == ivonet.CONVERSION_MODE_TRANSCODE:
+            return CONVERSION_MENU_TRANSCODE
+        return CONVERSION_MENU_REMUX
+
     def queue_project(self, filename):
         """Queue a project.
-        Wraps a project into an AudiobookEntry and puts it on the queue and start it.
-        AudiobookEntry will take care of the rest.
+        Wraps a project into an AudiobookEntry and puts it on the queue.
+        The scheduler starts it when there is a free slot and AudiobookEntry will take care of the rest.
         """
-        book = AudiobookEntry(self, filename)
+        book = AudiobookEntry(self, filename, self.conversion_mode)
         self.queue_sizer_v.Prepend(book, 0, wx.ALL | wx.EXPAND, 0)
         self.active_queue.append(book)
+        self.scheduler.submit(book)
+        self.layout_queue()
+
+    def move_in_queue(self, book, steps):
+        """Moves a queued book steps places in the queue (negative is earlier)"""
+        if self.scheduler.move(book, steps):
+            self.layout_queue()
+
+    def layout_queue(self):
+        """Shows the queued books on top in the order they will be started"""
+        for idx, book in enumerate(self.scheduler.queue()):
+            self.queue_sizer_v.Detach(book)
+            self.queue_sizer_v.Insert(idx, book, 0, wx.ALL | wx.EXPAND, 0)
         self.queue_window.Layout()
         self.Refresh()
-        book.start()
 
     def on_clean_queue_item(self, event: ProcessCleanEvent):
         """Handles the cleaning of a queued item after it has been stopped and the button is pressed again."""
@@ -246,6 +290,7 @@ class MainFrame(wx.Frame):
         self.remove_from_active_queue(event.obj)
 
     def remove_from_active_queue(self, book):
+        self.scheduler.release(book)
         try:
             self.active_queue.remove(book)
         except ValueError as e:
@@ -294,6 +339,9 @@ class MainFrame(wx.Frame):
         ini.add_section("Settings")
         ini.set('Settings', 'screen_size', str(self.GetSize()))
         ini.set('Settings', 'screen_pos', str(self.GetPosition()))
+        ini.set('Settings', 'conversion_mode', self.conversion_mode)
+        ini.set('Settings', 'max_concurrent_jobs', str(self.max_concurrent_jobs))
+        ini.set('Settings', 'queue_policy', self.scheduler.policy)
         with open(ivonet.SETTINGS_FILE, "w") as fp:
             ini.write(fp)
 
@@ -315,6 +363,15 @@ class MainFrame(wx.Frame):
                 self.Center()
             else:
                 self.SetPosition(position)
+            mode = ini.get('Settings', 'conversion_mode', fallback=ivonet.DEFAULT_CONVERSION_MODE)
+            if mode in ivonet.CONVERSION_MODES:
+                self.conversion_mode = mode
+            self.max_concurrent_jobs = ini.getint('Settings', 'max_concurrent_jobs', fallback=0)
+            if self.max_concurrent_jobs > 0:
+                self.scheduler.resize(self.max_concurrent_jobs)
+            policy = ini.get('Settings', 'queue_policy', fallback=POLICY_FIFO)
+            if policy in POLICIES:
+                self.scheduler.set_policy(policy)
         else:
             self.Center()
 
@@ -10,12 +10,20 @@ The Menubar
 
 import wx
 
+import ivonet
+
 # File Menu
 
 FILE_MENU_QUEUE = wx.NewIdRef()
 FILE_MENU_STOP_PROCESS = wx.NewIdRef()
 FILE_MENU_TO_DIR = wx.NewIdRef()
 
+# Conversion Menu
+
+CONVERSION_MENU_REMUX = wx.NewIdRef()
+CONVERSION_MENU_TRANSCODE = wx.NewIdRef()
+CONVERSION_MENU_SHORTEST_FIRST = wx.NewIdRef()
+
 
 class MenuBar(wx.MenuBar):
     """The Application menu."""
@@ -33,6 +41,17 @@ class MenuBar(wx.MenuBar):
 
         self.Append(file_menu, "&File")
 
+        conversion_menu = wx.Menu()
+        conversion_menu.AppendRadioItem(CONVERSION_MENU_REMUX, "Remux (lossless)",
+                                        "Copy the audio stream as is")
+        conversion_menu.AppendRadioItem(CONVERSION_MENU_TRANSCODE, f"Transcode (AAC {ivonet.TRANSCODE_BITRATE})",
+                                        "Re-encode the audio to AAC")
+        conversion_menu.AppendSeparator()
+        conversion_menu.AppendCheckItem(CONVERSION_MENU_SHORTEST_FIRST, "Shortest book first",
+                                        "Start the queued books with the shortest duration first")
+
+        self.Append(conversion_menu, "&Conversion")
+
         help_menu = wx.Menu()
         help_menu.Append(wx.ID_ABOUT)
 
@@ -43,6 +62,9 @@ class MenuBar(wx.MenuBar):
             (wx.ID_NEW, self.parent.on_clear),
             (wx.ID_EXIT, self.parent.on_exit),
             (wx.ID_ABOUT, self.parent.on_about),
+            (CONVERSION_MENU_REMUX, self.parent.on_conversion_mode),
+            (CONVERSION_MENU_TRANSCODE, self.parent.on_conversion_mode),
+            (CONVERSION_MENU_SHORTEST_FIRST, self.parent.on_queue_policy),
         ]
         for menu_id, handler in menu_handlers:
             self.parent.Bind(wx.EVT_MENU, handler, id=menu_id)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-21 11:26:03$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Reads the adrm (Audible DRM) atom straight from the aax file header.
+
+The atom lives in moov/trak/mdia/minf/stbl/stsd/aavd/adrm. The file is memory mapped and
+only the atom headers on that path are parsed (see ivonet.io.mp4), so just the first few KB
+are read from disk instead of starting a full ffprobe process.
+
+adrm payload layout (see libavformat/mov.c mov_read_adrm):
+    8 bytes  unknown
+    56 bytes drm blob (encrypted file key and iv)
+    4 bytes  unknown
+    20 bytes file checksum
+"""
+
+import struct
+from collections import namedtuple
+
+from ivonet.io.mp4 import Mp4
+
+DRM_BLOB_SIZE = 56
+
+Adrm = namedtuple("Adrm", ["blob", "checksum"])
+
+
+def read(filename):
+    """read(filename) -> Adrm(blob, checksum) or None if the file has no adrm atom"""
+    with Mp4(filename) as mp4:
+        for adrm in mp4.find_all("moov/trak/mdia/minf/stbl/stsd/aavd/adrm"):
+            if adrm.size - adrm.header_size >= 8 + DRM_BLOB_SIZE + 4 + 20:
+                start = adrm.payload_offset + 8
+                blob = mp4.mm[start:start + DRM_BLOB_SIZE]
+                start += DRM_BLOB_SIZE + 4
+                return Adrm(blob, mp4.mm[start:start + 20])
+    return None
+
+
+def checksum(filename):
+    """checksum(filename) -> the aax checksum as hex string (like ffprobe reports it) or None"""
+    try:
+        ret = read(filename)
+    except (IOError, ValueError, struct.error):
+        return None
+    return ret.checksum.hex() if ret else None
+
+
+__all__ = [
+    "Adrm",
+    "read",
+    "checksum",
+]
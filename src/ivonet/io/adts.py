@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-24 21:18:36$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Concatenation of separately encoded AAC segments in ADTS format without gaps or clicks.
+
+An AAC encoder starts every stream with one priming frame (1024 samples of encoder delay) and
+every decoded frame is the overlap-add of the second half of the previous frame's MDCT window
+and the first half of its own. A frame next to the start or the end of a segment is encoded
+against the silence outside the segment, so just dropping the priming frame would still
+overlap-add mismatched halves at every join.
+
+So every segment is encoded with OVERLAP_FRAMES frames of audio of its neighbours on both
+sides (cut on AAC frame boundaries, multiples of 1024 samples) and the join is made on frame
+level where both sides were encoded against the real audio:
+- the first segment keeps its priming frame (removed with an edit list when muxing) and its
+  frames up to the boundary
+- every next segment drops its priming frame and its OVERLAP_FRAMES lead-in frames
+See keep() for the frames of a segment.
+"""
+
+import mmap
+import os
+
+SAMPLES_PER_FRAME = 1024
+PRIMING_FRAMES = 1
+OVERLAP_FRAMES = 2  # the encoder also needs a few frames to settle (psychoacoustic model, bit reservoir)
+HEADER_SIZE = 7
+
+
+def frames(data):
+    """frames(data) -> yields (offset, length) of every ADTS frame in data"""
+    pos = 0
+    while pos + HEADER_SIZE <= len(data):
+        if data[pos] != 0xFF or data[pos + 1] & 0xF0 != 0xF0:
+            raise ValueError(f"No ADTS sync word at offset {pos}")
+        length = ((data[pos + 3] & 0x03) << 11) | (data[pos + 4] << 3) | (data[pos + 5] >> 5)
+        if length < HEADER_SIZE:
+            raise ValueError(f"Invalid ADTS frame length at offset {pos}")
+        yield pos, length
+        pos += length
+
+
+def bounds(starts: list) -> list:
+    """bounds([segment start sample]) -> [(encode start, encode end or None)] in samples
+
+    The segment starts must be multiples of SAMPLES_PER_FRAME. Every segment is encoded with
+    OVERLAP_FRAMES frames of its neighbours on both sides (the end is None for the last segment).
+    """
+    overlap = OVERLAP_FRAMES * SAMPLES_PER_FRAME
+    ret = []
+    for idx, start in enumerate(starts):
+        end = starts[idx + 1] + overlap if idx + 1 < len(starts) else None
+        ret.append((max(0, start - overlap) if idx else 0, end))
+    return ret
+
+
+def keep(starts: list, idx: int) -> tuple:
+    """keep([segment start sample], idx) -> (first frame, number of frames or None for all) to keep of the segment
+
+    Frame n (n >= 1) of a segment encoded from sample s decodes to the samples [s + (n - 1) * 1024, s + n * 1024)
+    and its window covers [s + (n - 1) * 1024, s + (n + 1) * 1024). The kept frames of both sides of a
+    join have windows inside the audio their segment was encoded with.
+    """
+    first = 0 if idx == 0 else PRIMING_FRAMES + OVERLAP_FRAMES
+    if idx + 1 == len(starts):
+        return first, None
+    count = (starts[idx + 1] - starts[idx]) // SAMPLES_PER_FRAME
+    return first, count + (PRIMING_FRAMES if idx == 0 else 0)
+
+
+def concat(segments: list, output: str):
+    """concat([(filename, first frame, number of frames or None)], output) -> writes the frames as one stream"""
+    with open(output, "wb") as fo:
+        for segment, first, count in segments:
+            if os.path.getsize(segment) == 0:
+                continue
+            with open(segment, "rb") as fi, mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                kept = list(frames(mm))[first:None if count is None else first + count]
+                if kept:
+                    fo.write(mm[kept[0][0]:kept[-1][0] + kept[-1][1]])
+
+
+__all__ = [
+    "SAMPLES_PER_FRAME",
+    "PRIMING_FRAMES",
+    "bounds",
+    "frames",
+    "keep",
+    "concat",
+]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-28 10:12:45$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Cover art extraction straight from the container.
+
+The image is the covr item of the ilst or else the (single) sample of an attached picture
+(jpeg / png video track). It is written from the memory mapped file without copying it in
+between and without starting ffmpeg.
+"""
+
+from ivonet.io.mp4 import Mp4
+
+PICTURE_ENTRIES = {"jpeg", "png ", "mp4v"}
+
+
+def _attached_picture(mp4: Mp4):
+    """The first sample of a picture track as memoryview or None"""
+    for track in mp4.tracks("vide"):
+        stsd = track.stbl.find("stsd")
+        if not any(entry.kind in PICTURE_ENTRIES for entry in stsd.children):
+            continue
+        for sample in track.samples():
+            return memoryview(mp4.mm)[sample.offset:sample.offset + sample.size]
+    return None
+
+
+def extract(source: str, target: str) -> bool:
+    """extract(source, target) -> True if the cover of the source has been written to the target"""
+    with Mp4(source) as mp4:
+        image = mp4.cover()
+        if image is None:
+            image = _attached_picture(mp4)
+        if image is None:
+            return False
+        try:
+            with open(target, "wb") as fo:
+                fo.write(image)
+        finally:
+            image.release()
+    return True
+
+
+__all__ = [
+    "extract",
+]
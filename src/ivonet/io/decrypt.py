@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-26 19:44:10$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+In process aax decryption without the demux / mux cycle of ffmpeg.
+
+Only the audio sample payloads of an aax are encrypted (AES-128-CBC, every sample on its own
+with the same key and iv, the trailing bytes that do not fill a block are not encrypted).
+So the output has exactly the same layout as the input and no offsets change:
+- the samples are decrypted from the memory mapped aax into the preallocated (memory mapped) output
+- everything in between is copied as is
+- only a few atom headers are patched: the 'aax ' brand becomes 'M4B ', the aavd sample entry
+  becomes mp4a and the adrm atom becomes a free atom.
+- the moov is rebuilt with the given tags, Nero chapters and free padding after the tags (see ivonet.io.mp4tags),
+  so later tag changes do not rewrite the file. When the moov is in front of the media data
+  everything after it moves by the size difference and the chunk offsets are corrected.
+
+A sample is only a few hundred bytes, so decrypting them one by one is all cipher setup and
+slicing overhead. With numpy the samples are decrypted in batches instead: the blocks of all the
+samples of a batch are gathered and decrypted with one ECB call and CBC is finished by xor-ing
+every block with the ciphertext block before it (the iv at the start of every sample).
+
+Because every sample is encrypted on its own the file can be split in byte ranges on sample
+boundaries. Large books are decrypted by DECRYPT_CONCURRENCY threads, every thread maps the
+pre-sized output and fills its own ranges. The ECB calls release the GIL, the extra processes of
+a ProcessPoolExecutor are avoided (forking the threaded gui or re-running the frozen app).
+The caller only writes the patched headers.
+
+Needs pycryptodome (see ivonet.drm.aax.can_decrypt). numpy is optional but a lot faster.
+"""
+
+import mmap
+from array import array
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import ivonet
+from ivonet.drm import aax
+from ivonet.io import mp4tags
+from ivonet.io.mp4 import Mp4
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLOCK_MASK = ~0xF
+BLOCK_SIZE = 16
+BATCH_SIZE = 4096  # samples decrypted at once and between progress reports and cancellation checks
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024  # smaller files are not worth splitting
+RANGES_PER_WORKER = 4  # more ranges than workers so a slow range does not hold up the rest
+POLL_INTERVAL = 0.5
+
+
+class Plan(object):
+    """What has to be done to decrypt an aax.
+
+    The key, the encrypted samples (offsets and sizes), the new moov and the header patches.
+    """
+
+    def __init__(self, mp4: Mp4, activation_bytes, tags=None, padding=None, chapters=None) -> None:
+        adrm = mp4.find("moov/trak/mdia/minf/stbl/stsd/aavd/adrm")
+        if not adrm:
+            raise ValueError(f"Not an aax file: {mp4.filename}")
+        blob = mp4.mm[adrm.payload_offset + 8:adrm.payload_offset + 8 + 56]
+        self.key, self.iv = aax.file_key(activation_bytes, blob)
+        self.size = len(mp4.mm)
+        patches = [(adrm.offset + 4, b"free")]
+        tables = []
+        for track in mp4.tracks():
+            stsd = track.stbl.find("stsd")
+            entries = [entry for entry in stsd.children if entry.kind == "aavd"]
+            if not entries:
+                continue
+            patches += [(entry.offset + 4, b"mp4a") for entry in entries]
+            tables.append((track.sample_offsets(), track.sample_sizes()))
+        # the sample tables stay compact arrays, a long book has millions of samples
+        self.offsets, self.sizes = _merge(tables)
+        self.patches = []
+        ftyp = mp4.find("ftyp")
+        if ftyp:
+            self.patches.append((ftyp.payload_offset, b"M4B "))
+            for offset in range(ftyp.payload_offset + 8, ftyp.end - 3, 4):
+                if mp4.mm[offset:offset + 4] == b"aax ":
+                    self.patches.append((offset, b"M4B "))
+        current = mp4.find("moov")
+        self.moov_start, self.moov_end = current.offset, current.end
+        self.moov = mp4tags.moov(mp4, mp4tags.ilst(mp4, tags), padding, patches, chapters)
+        self.shift = len(self.moov) - (self.moov_end - self.moov_start)
+
+    @property
+    def target_size(self) -> int:
+        return self.size + self.shift
+
+    def ranges(self, count: int) -> list:
+        """ranges(count) -> [(start, end, shift, first, last)] the file outside the moov split on sample boundaries
+
+        The bytes in [start, end) go to [start + shift, end + shift) in the target and
+        hold the samples with the index in [first, last).
+        """
+        per_range = -(-len(self.offsets) // max(1, count)) or 1
+        bounds = [0] + [self.offsets[idx] for idx in range(per_range, len(self.offsets), per_range)] + [self.size]
+        ret = []
+        for start, end in zip(bounds, bounds[1:]):
+            for region_start, region_end, shift in ((0, self.moov_start, 0), (self.moov_end, self.size, self.shift)):
+                part_start, part_end = max(start, region_start), min(end, region_end)
+                if part_start < part_end:
+                    ret.append((part_start, part_end, shift,
+                                bisect_left(self.offsets, part_start), bisect_left(self.offsets, part_end)))
+        return ret
+
+
+def _merge(tables: list) -> tuple:
+    """_merge([(offsets, sizes)]) -> the sample tables of the tracks as one (offsets, sizes) table sorted on offset"""
+    if len(tables) == 1 and all(a <= b for a, b in zip(tables[0][0], islice(tables[0][0], 1, None))):
+        return tables[0]
+    offsets, sizes = array("Q"), array("Q")
+    for track_offsets, track_sizes in tables:
+        offsets.extend(track_offsets)
+        sizes.extend(array("Q", track_sizes))
+    order = sorted(range(len(offsets)), key=offsets.__getitem__)
+    return array("Q", (offsets[idx] for idx in order)), array("Q", (sizes[idx] for idx in order))
+
+
+def _decrypt_sample(key: bytes, iv: bytes, source, target):
+    """Decrypts the whole blocks of one sample from the source buffer into the target buffer"""
+    blocks = len(source) & BLOCK_MASK
+    AES.new(key, AES.MODE_CBC, iv).decrypt(source[:blocks], output=target[:blocks])
+
+
+def _decrypt_samples(plan: Plan, first: int, last: int, source, target, delta: int):
+    """Decrypts the samples [first, last) from the source buffer into the target buffer (at offset + delta)
+
+    CBC decryption of a block is the ECB decryption xor the ciphertext block before it, so all the
+    blocks of the batch are decrypted with one ECB call and chained with numpy afterwards.
+    """
+    offsets = numpy.frombuffer(plan.offsets, dtype=numpy.uint64, count=last - first,
+                               offset=first * plan.offsets.itemsize).astype(numpy.int64)
+    sizes = numpy.frombuffer(plan.sizes, dtype=f"u{plan.sizes.itemsize}", count=last - first,
+                             offset=first * plan.sizes.itemsize)
+    counts = (sizes // BLOCK_SIZE).astype(numpy.int64)
+    total = int(counts.sum())
+    if not total:
+        return
+    starts = numpy.cumsum(counts) - counts  # the index of the first block of every sample
+    sample = numpy.repeat(numpy.arange(len(counts)), counts)
+    index = (offsets[sample] + (numpy.arange(total) - starts[sample]) * BLOCK_SIZE)[:, None] + numpy.arange(BLOCK_SIZE)
+    ciphertext = numpy.frombuffer(source, dtype=numpy.uint8)[index]
+    plaintext = numpy.empty_like(ciphertext)
+    AES.new(plan.key, AES.MODE_ECB).decrypt(memoryview(ciphertext).cast("B"), output=memoryview(plaintext).cast("B"))
+    chain = numpy.empty_like(ciphertext)
+    chain[1:] = ciphertext[:-1]
+    chain[starts[counts > 0]] = numpy.frombuffer(plan.iv, dtype=numpy.uint8)
+    numpy.frombuffer(target, dtype=numpy.uint8)[index + delta] = plaintext ^ chain
+
+
+def decrypt(source: str, target: str, activation_bytes, progress=None, cancelled=None, workers=None,
+            tags=None, chapters=None) -> bool:
+    """decrypt(source, target, activation_bytes, progress, cancelled, workers, tags, chapters) -> True if written
+
+    progress is an optional callable receiving the percentage done.
+    cancelled is an optional callable that stops the decryption when it returns True.
+    workers is the number of threads for large files (default DECRYPT_CONCURRENCY).
+    tags are written to the target on top of the tags of the source (see ivonet.io.mp4tags).
+    chapters [(start seconds, title)] are written as Nero chapters next to the QuickTime chapter track.
+    Raises ValueError if the source is not an aax or the activation bytes do not fit.
+    """
+    workers = workers or ivonet.DECRYPT_CONCURRENCY
+    with Mp4(source) as mp4:
+        plan = Plan(mp4, activation_bytes, tags, chapters=chapters)
+        with open(target, "w+b") as fo:
+            fo.truncate(plan.target_size)
+            if workers > 1 and plan.size >= PARALLEL_MIN_SIZE:
+                done = _decrypt_parallel(plan, mp4.mm, target, workers, progress, cancelled)
+            else:
+                done = all(_copy_range(plan, part, mp4.mm, fo, progress, cancelled) for part in plan.ranges(1))
+            if not done:
+                return False
+            fo.seek(plan.moov_start)
+            fo.write(plan.moov)
+            for offset, data in plan.patches:
+                fo.seek(offset)
+                fo.write(data)
+    return True
+
+
+def _decrypt_range(plan: Plan, part: tuple, mm, target: str, cancelled=None) -> int:
+    """_decrypt_range(plan, part, mm, target, cancelled) -> the number of bytes written or None if cancelled
+
+    Runs in a worker thread.
+    """
+    with open(target, "r+b") as fo:
+        if not _copy_range(plan, part, mm, fo, cancelled=cancelled):
+            return None
+    return part[1] - part[0]
+
+
+def _decrypt_parallel(plan: Plan, mm, target: str, workers: int, progress, cancelled) -> bool:
+    todo = plan.ranges(workers * RANGES_PER_WORKER)
+    total = sum(part[1] - part[0] for part in todo) or 1
+    written = 0
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decrypt")
+    try:
+        running = {executor.submit(_decrypt_range, plan, part, mm, target, cancelled) for part in todo}
+        while running:
+            if cancelled and cancelled():
+                return False
+            finished, running = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future.result() is None:
+                    return False
+                written += future.result()
+            if finished and progress:
+                progress(int(written * 100 / total))
+    finally:
+        # the running ranges stop at their next cancellation check and must be done before the mmap closes
+        executor.shutdown(wait=True, cancel_futures=True)
+    return True
+
+
+def _copy_range(plan: Plan, part: tuple, mm, fo, progress=None, cancelled=None) -> bool:
+    """Copies the byte range from the source mmap to the target file and decrypts the samples in it"""
+    start, end, shift, first, last = part
+    if start == end:
+        return True
+    # mmap offsets must be page aligned
+    base = start + shift - (start + shift) % mmap.ALLOCATIONGRANULARITY
+    delta = shift - base  # source offset + delta = offset in the target mmap
+    with mmap.mmap(fo.fileno(), end + delta, offset=base) as out:
+        source = memoryview(mm)
+        target = memoryview(out)
+        try:
+            # everything as is, the encrypted blocks of the samples are overwritten below
+            target[start + delta:end + delta] = source[start:end]
+            for batch in range(first, last, BATCH_SIZE):
+                if cancelled and cancelled():
+                    return False
+                if progress:
+                    progress(int((batch - first) * 100 / (last - first)))
+                batch_end = min(batch + BATCH_SIZE, last)
+                if numpy is not None:
+                    _decrypt_samples(plan, batch, batch_end, source, target, delta)
+                    continue
+                for idx in range(batch, batch_end):
+                    offset, length = plan.offsets[idx], plan.sizes[idx]
+                    _decrypt_sample(plan.key, plan.iv, source[offset:offset + length],
+                                    target[offset + delta:offset + delta + length])
+        finally:
+            source.release()
+            target.release()
+    return True
+
+
+__all__ = [
+    "decrypt",
+    "Plan",
+]
@@ -10,55 +10,48 @@ __doc__ = """
 
 import json
 import subprocess
-from io import StringIO
 
 import ivonet
 from ivonet.events import dbg
+from ivonet.io import probecache
 
 
-def checksum(filename) -> str:
-    keep_going = True
+def probe(filename) -> dict:
+    """probe(filename) -> format, streams and chapters of the file plus the aax checksum.
+
+    Everything is retrieved with one ffprobe run. The json goes to stdout and the checksum
+    is reported in the log on stderr. The checksum is None if the file has none.
+    The result is cached until the file changes.
+    Raises IOError if ffprobe fails or does not report the format.
+    """
+    ret = probecache.lookup(filename)
+    if ret:
+        dbg(f"Probe cache hit for: {filename}")
+        return ret
     cmd = [
         ivonet.APP_FFPROBE,
+        "-hide_banner",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        "-show_chapters",
         f"{filename}"
     ]
-
-    process = shell_command(cmd)
-
-    ret = None
-    while keep_going:
-        try:
-            line = process.stdout.readline()
-        except UnicodeDecodeError:
-            #  just skip a line
-            continue
-        dbg(line)
-        if not line:
-            dbg(f"No more input from subprocess")
-            keep_going = False
-            break
-        # print(line)
+    dbg(cmd)
+    process = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise IOError(f"Could not probe [{process.returncode}]: {filename}")
+    try:
+        ret = json.loads(process.stdout)
+    except ValueError:
+        raise IOError(f"Could not probe: {filename}")
+    if "format" not in ret:
+        raise IOError(f"No format found while probing: {filename}")
+    ret["checksum"] = None
+    for line in process.stderr.decode("utf-8", "replace").splitlines():
         if "checksum == " in line:
-            ret = line.split("== ")[1]
-    process.stdout.close()
-    if process.returncode != 0 and keep_going:
-        raise IOError("Could not retrieve checksum")
-    return ret.strip()
-
-
-def metadata(filename) -> dict:
-    output = subprocess.getoutput(f'{ivonet.APP_FFPROBE} -print_format json -show_format -v quiet "{filename}"')
-    return json.load(StringIO(output))
-
+            ret["checksum"] = line.split("== ")[1].strip()
+    if probecache.complete(ret):
+        probecache.store(filename, ret)
+    return ret
 
-def shell_command(cmd):
-    process = subprocess.Popen(
-        cmd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        shell=False,
-        universal_newlines=True,
-    )
-    process.stdin.close()
-    return process
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-21 16:52:30$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Lazy MP4 (and aax / m4a / m4b) atom tree reader on top of a memory mapped file.
+
+Atoms are only parsed when their children are asked for, so opening a file and looking
+up a few atoms reads just the pages needed. Payloads are returned as memoryview slices of
+the mmap (zero copy). 64 bit atom sizes (files > 4GB) and co64 chunk offsets are supported.
+
+Example:
+    with Mp4(filename) as mp4:
+        adrm = mp4.find("moov/trak/mdia/minf/stbl/stsd/aavd/adrm")
+        cover = mp4.cover()
+        chapters = mp4.chapters()
+
+Memoryviews handed out must be released before the Mp4 is closed.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+CONTAINERS = {
+    "moov", "trak", "mdia", "minf", "stbl", "udta", "edts", "dinf", "tref", "ilst",
+    "mvex", "moof", "traf", "mfra", "sinf", "schi", "wave",
+}
+AUDIO_SAMPLE_ENTRIES = {"mp4a", "aavd", "alac", "ac-3", "ec-3", "Opus", "fLaC"}
+AUDIO_SAMPLE_ENTRY_SIZE = {0: 28, 1: 44, 2: 64}  # by sound sample description version
+NERO_TIMESCALE = 10000000  # chpl start times are in 100 nanoseconds
+
+Chapter = namedtuple("Chapter", ["start", "end", "title"])
+Sample = namedtuple("Sample", ["offset", "size", "time", "duration"])
+
+
+def _uint32_array(data) -> array:
+    """Big endian uint32 table to an array"""
+    ret = array("I")
+    if ret.itemsize != 4:
+        ret = array("L")
+    ret.frombytes(data)
+    if sys.byteorder == "little":
+        ret.byteswap()
+    return ret
+
+
+def _uint64_array(data) -> array:
+    """Big endian uint64 table to an array"""
+    ret = array("Q")
+    ret.frombytes(data)
+    if sys.byteorder == "little":
+        ret.byteswap()
+    return ret
+
+
+def parse_atoms(mm, start: int, end: int, parent=None):
+    """parse_atoms(mm, start, end, parent) -> yields the atoms between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", mm, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", mm, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            return
+        yield Atom(mm, kind.decode("latin-1"), pos, header_size, size, parent)
+        pos += size
+
+
+class Atom(object):
+    __slots__ = ("mm", "kind", "offset", "header_size", "size", "parent", "_children")
+
+    def __init__(self, mm, kind: str, offset: int, header_size: int, size: int, parent=None) -> None:
+        self.mm = mm
+        self.kind = kind
+        self.offset = offset
+        self.header_size = header_size
+        self.size = size
+        self.parent = parent
+        self._children = None
+
+    def __repr__(self):
+        return f"Atom({self.kind!r}, offset={self.offset}, size={self.size})"
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def payload(self) -> memoryview:
+        """The payload (everything after the header) as zero copy memoryview"""
+        return memoryview(self.mm)[self.payload_offset:self.end]
+
+    def _children_offset(self):
+        """Offset of the first child atom or None if this atom has no children"""
+        parent_kind = self.parent.kind if self.parent else None
+        if self.kind in CONTAINERS or parent_kind == "ilst":
+            return self.payload_offset
+        if self.kind == "meta":
+            # iTunes meta is a full box, QuickTime meta is not
+            if self.mm[self.payload_offset + 4:self.payload_offset + 8] == b"hdlr":
+                return self.payload_offset
+            return self.payload_offset + 4
+        if self.kind in ("stsd", "dref"):
+            return self.payload_offset + 8
+        if parent_kind == "stsd" and self.kind in AUDIO_SAMPLE_ENTRIES:
+            version = struct.unpack_from(">H", self.mm, self.payload_offset + 8)[0]
+            return self.payload_offset + AUDIO_SAMPLE_ENTRY_SIZE.get(version, 28)
+        return None
+
+    @property
+    def children(self) -> list:
+        if self._children is None:
+            start = self._children_offset()
+            self._children = [] if start is None else list(parse_atoms(self.mm, start, self.end, self))
+        return self._children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def find_all(self, path: str):
+        """find_all("trak/mdia") -> yields all the atoms matching the slash separated path"""
+        kind, _, rest = path.partition("/")
+        for child in self.children:
+            if child.kind == kind:
+                if rest:
+                    yield from child.find_all(rest)
+                else:
+                    yield child
+
+    def find(self, path: str):
+        """find("trak/mdia") -> the first atom matching the slash separated path or None"""
+        return next(self.find_all(path), None)
+
+
+class Track(object):
+    """Sample table access of a trak atom"""
+
+    def __init__(self, trak: Atom) -> None:
+        self.trak = trak
+        tkhd = trak.find("tkhd")
+        version = tkhd.payload[0]
+        self.id = struct.unpack_from(">I", tkhd.payload, 20 if version == 1 else 12)[0]
+        hdlr = trak.find("mdia/hdlr")
+        self.handler = bytes(hdlr.payload[8:12]).decode("latin-1") if hdlr else None
+        mdhd = trak.find("mdia/mdhd")
+        if mdhd.payload[0] == 1:
+            self.timescale, self.duration = struct.unpack_from(">IQ", mdhd.payload, 20)
+        else:
+            self.timescale, self.duration = struct.unpack_from(">II", mdhd.payload, 12)
+        self.stbl = trak.find("mdia/minf/stbl")
+
+    def references(self, kind: str) -> list:
+        """references("chap") -> the track ids referenced by the tref child of the given kind"""
+        tref = self.trak.find(f"tref/{kind}")
+        return list(_uint32_array(tref.payload)) if tref else []
+
+    def sample_sizes(self) -> array:
+        stsz = self.stbl.find("stsz").payload
+        sample_size, count = struct.unpack_from(">II", stsz, 4)
+        if sample_size:
+            return array("L", [sample_size]) * count
+        return _uint32_array(stsz[12:12 + count * 4])
+
+    def chunk_offsets(self) -> array:
+        stco = self.stbl.find("stco")
+        if stco:
+            count = struct.unpack_from(">I", stco.payload, 4)[0]
+            return _uint32_array(stco.payload[8:8 + count * 4])
+        co64 = self.stbl.find("co64").payload
+        count = struct.unpack_from(">I", co64, 4)[0]
+        return _uint64_array(co64[8:8 + count * 8])
+
+    def sample_to_chunk(self) -> list:
+        """[(first chunk, samples per chunk, sample description index)] with 1 based chunk numbers"""
+        stsc = self.stbl.find("stsc").payload
+        count = struct.unpack_from(">I", stsc, 4)[0]
+        table = _uint32_array(stsc[8:8 + count * 12])
+        return [tuple(table[i:i + 3]) for i in range(0, len(table), 3)]
+
+    def time_to_sample(self) -> list:
+        """[(sample count, sample delta)]"""
+        stts = self.stbl.find("stts").payload
+        count = struct.unpack_from(">I", stts, 4)[0]
+        table = _uint32_array(stts[8:8 + count * 8])
+        return [tuple(table[i:i + 2]) for i in range(0, len(table), 2)]
+
+    def sample_offsets(self) -> array:
+        """The file offset of every sample"""
+        sizes = self.sample_sizes()
+        chunks = self.chunk_offsets()
+        stsc = self.sample_to_chunk()
+        ret = array("Q")
+        sample = 0
+        for idx, (first_chunk, per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[idx + 1][0] if idx + 1 < len(stsc) else len(chunks) + 1
+            for chunk in range(first_chunk - 1, last_chunk - 1):
+                offset = chunks[chunk]
+                for size in sizes[sample:sample + per_chunk]:
+                    ret.append(offset)
+                    offset += size
+                sample += per_chunk
+        return ret
+
+    def samples(self):
+        """yields Sample(offset, size, time, duration) for every sample. Time and duration in timescale units"""
+        durations = (delta for count, delta in self.time_to_sample() for _ in range(count))
+        time = 0
+        for offset, size, duration in zip(self.sample_offsets(), self.sample_sizes(), durations):
+            yield Sample(offset, size, time, duration)
+            time += duration
+
+
+class Mp4(object):
+    def __init__(self, filename) -> None:
+        self.filename = filename
+        with open(filename, "rb") as fi:
+            self.mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        self._children = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._children = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # memoryviews handed out are still alive; the mmap is closed when they are garbage collected
+            pass
+
+    @property
+    def children(self) -> list:
+        if self._children is None:
+            self._children = list(parse_atoms(self.mm, 0, len(self.mm)))
+        return self._children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    find_all = Atom.find_all
+    find = Atom.find
+
+    def tracks(self, handler=None) -> list:
+        """tracks("soun") -> the tracks, optionally only those with the given handler type"""
+        ret = [Track(trak) for trak in self.find_all("moov/trak")]
+        return [track for track in ret if handler is None or track.handler == handler]
+
+    def duration(self) -> float:
+        """duration() -> the movie duration in seconds"""
+        mvhd = self.find("moov/mvhd").payload
+        if mvhd[0] == 1:
+            timescale, duration = struct.unpack_from(">IQ", mvhd, 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", mvhd, 12)
+        return duration / timescale if timescale else 0.0
+
+    def cover(self):
+        """cover() -> the covr image as zero copy memoryview or None"""
+        data = self.find("moov/udta/meta/ilst/covr/data")
+        return data.payload[8:] if data else None
+
+    def tags(self) -> dict:
+        """tags() -> {atom kind: text} of all the text items in the ilst"""
+        ret = {}
+        for item in self.find_all("moov/udta/meta/ilst"):
+            for tag in item:
+                data = tag.find("data")
+                if data and struct.unpack_from(">I", data.payload)[0] == 1:
+                    ret[tag.kind] = bytes(data.payload[8:]).decode("utf-8", "replace")
+        return ret
+
+    def chapters(self) -> list:
+        """chapters() -> [Chapter(start, end, title)] in seconds from the QuickTime chapter track or the Nero chpl"""
+        return self.quicktime_chapters() or self.nero_chapters()
+
+    def quicktime_chapters(self) -> list:
+        tracks = {track.id: track for track in self.tracks()}
+        for track in tracks.values():
+            for chapter_id in track.references("chap"):
+                text = tracks.get(chapter_id)
+                if not text:
+                    continue
+                ret = []
+                for sample in text.samples():
+                    length = struct.unpack_from(">H", self.mm, sample.offset)[0] if sample.size >= 2 else 0
+                    title = self.mm[sample.offset + 2:sample.offset + 2 + length].decode("utf-8", "replace")
+                    ret.append(Chapter(sample.time / text.timescale,
+                                       (sample.time + sample.duration) / text.timescale,
+                                       title))
+                return ret
+        return []
+
+    def nero_chapters(self) -> list:
+        chpl = self.find("moov/udta/chpl")
+        if not chpl:
+            return []
+        data = chpl.payload
+        pos = 8 if data[0] else 4
+        count = data[pos]
+        pos += 1
+        starts = []
+        for _ in range(count):
+            start, length = struct.unpack_from(">QB", data, pos)
+            pos += 9
+            starts.append((start / NERO_TIMESCALE, bytes(data[pos:pos + length]).decode("utf-8", "replace")))
+            pos += length
+        ends = [start for start, _ in starts[1:]] + [self.duration()]
+        return [Chapter(start, end, title) for (start, title), end in zip(starts, ends)]
+
+
+__all__ = [
+    "Mp4",
+    "Atom",
+    "Track",
+    "Chapter",
+    "Sample",
+    "parse_atoms",
+]
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-27 14:31:09$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+iTunes style tag (moov/udta/meta/ilst) and cover (covr) writer for mp4 / m4b files.
+
+The ilst is followed by a free atom (padding, TAG_PADDING bytes when the moov is (re)built).
+As long as the new ilst fits in the old ilst plus that padding it is written in place and
+only a few KB of the file are touched. Otherwise the moov is rebuilt with fresh padding:
+- moov at the end of the file: the moov is rewritten in place (nothing moves)
+- moov in front of the mdat: the file is rewritten and the chunk offsets are corrected
+
+The Nero chapter list (moov/udta/chpl) can be written in the same moov rebuild.
+
+The tags are given like the ffmpeg -metadata options, e.g. {"title": "...", "media_type": "2"}.
+An empty value removes the tag.
+"""
+
+import os
+import struct
+import tempfile
+
+import ivonet
+from ivonet.io.mp4 import NERO_TIMESCALE, Mp4, parse_atoms
+
+TAGS = {
+    "title": "©nam",
+    "album": "©alb",
+    "artist": "©ART",
+    "album_artist": "aART",
+    "composer": "©wrt",
+    "genre": "©gen",
+    "comment": "©cmt",
+    "description": "desc",
+    "synopsis": "ldes",
+    "copyright": "cprt",
+    "date": "©day",
+    "year": "©day",
+    "encoding_tool": "©too",
+    "media_type": "stik",
+}
+TYPE_UTF8 = 1
+TYPE_JPEG = 13
+TYPE_PNG = 14
+TYPE_INTEGER = 21
+INTEGER_TAGS = {"stik"}
+COPY_BUFFER = 16 * 1024 * 1024
+MAX_NERO_CHAPTERS = 255  # the chapter count of a chpl is one byte
+
+
+def atom(kind: str, *payload) -> bytes:
+    """atom("free", b"...") -> the atom with a 32 bit header"""
+    data = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(data), kind.encode("latin-1")) + data
+
+
+def free(size: int) -> bytes:
+    """free(size) -> a free atom of exactly size bytes (header included)"""
+    return struct.pack(">I4s", size, b"free") + b"\0" * (size - 8)
+
+
+def item(kind: str, value) -> bytes:
+    """item("©nam", "title") -> an ilst item with its data atom"""
+    if kind == "covr":
+        data_type = TYPE_PNG if bytes(value[:4]) == b"\x89PNG" else TYPE_JPEG
+        value = bytes(value)
+    elif kind in INTEGER_TAGS:
+        data_type = TYPE_INTEGER
+        value = bytes([int(value)])
+    else:
+        data_type = TYPE_UTF8
+        value = str(value).encode("utf-8")
+    return atom(kind, atom("data", struct.pack(">II", data_type, 0), value))
+
+
+def ilst(mp4: Mp4, tags=None, cover=None) -> bytes:
+    """ilst(mp4, tags, cover) -> the ilst of the mp4 with the tags and cover replaced"""
+    updates = {}
+    for name, value in (tags or {}).items():
+        updates[TAGS.get(name, name)] = value
+    if cover is not None:
+        updates["covr"] = cover
+    items = []
+    current = mp4.find("moov/udta/meta/ilst")
+    for child in current or []:
+        if child.kind in updates:
+            continue
+        items.append(mp4.mm[child.offset:child.end])
+    for kind, value in updates.items():
+        if value is None or value == "":
+            continue
+        items.append(item(kind, value))
+    return atom("ilst", *items)
+
+
+def _padding_after(atom_) -> list:
+    """The free atoms directly following the atom in its parent"""
+    ret = []
+    siblings = atom_.parent.children
+    for sibling in siblings[siblings.index(atom_) + 1:]:
+        if sibling.kind != "free":
+            break
+        ret.append(sibling)
+    return ret
+
+
+def _in_place(mp4: Mp4, new_ilst: bytes):
+    """The (offset, data) to write the ilst in place or None if it does not fit"""
+    current = mp4.find("moov/udta/meta/ilst")
+    if not current:
+        return None
+    padding = _padding_after(current)
+    end = padding[-1].end if padding else current.end
+    space = end - current.offset
+    if len(new_ilst) == space:
+        return current.offset, new_ilst
+    if len(new_ilst) + 8 <= space:
+        return current.offset, new_ilst + free(space - len(new_ilst))
+    return None
+
+
+def _grow(data: bytearray, base: int, ancestors, delta: int):
+    """Adds delta to the sizes of the ancestor atoms in data (a copy of the file starting at base)"""
+    for ancestor in ancestors:
+        if ancestor.header_size == 16:
+            offset = ancestor.offset - base + 8
+            struct.pack_into(">Q", data, offset, struct.unpack_from(">Q", data, offset)[0] + delta)
+        else:
+            offset = ancestor.offset - base
+            struct.pack_into(">I", data, offset, struct.unpack_from(">I", data, offset)[0] + delta)
+
+
+def _meta(new_ilst: bytes, padding: int) -> bytes:
+    hdlr = atom("hdlr", b"\0" * 8, b"mdir", b"appl", b"\0" * 9)
+    return atom("meta", b"\0" * 4, hdlr, new_ilst, free(padding))
+
+
+def _shift_chunk_offsets(data: bytearray, moov_end: int, delta: int):
+    """Adds delta to all the chunk offsets in the moov (data) pointing after the old moov end"""
+    moov = next(parse_atoms(data, 0, len(data)))
+    for kind, fmt, limit in (("stco", "I", 0xFFFFFFFF), ("co64", "Q", 0xFFFFFFFFFFFFFFFF)):
+        for table in moov.find_all(f"trak/mdia/minf/stbl/{kind}"):
+            count = struct.unpack_from(">I", data, table.payload_offset + 4)[0]
+            offsets = list(struct.unpack_from(f">{count}{fmt}", data, table.payload_offset + 8))
+            offsets = [offset + delta if offset >= moov_end else offset for offset in offsets]
+            if offsets and max(offsets) > limit:
+                raise ValueError("The chunk offsets do not fit in the stco anymore")
+            struct.pack_into(f">{count}{fmt}", data, table.payload_offset + 8, *offsets)
+
+
+def chpl(chapters) -> bytes:
+    """chpl([(start seconds, title)]) -> the Nero chapter list atom (at most 255 chapters)"""
+    entries = []
+    for start, title in list(chapters)[:MAX_NERO_CHAPTERS]:
+        title = str(title).encode("utf-8")[:255]
+        entries.append(struct.pack(">QB", round(start * NERO_TIMESCALE), len(title)) + title)
+    return atom("chpl", struct.pack(">IIB", 0x01000000, 0, len(entries)), *entries)
+
+
+def moov(mp4: Mp4, new_ilst: bytes, padding=None, patches=(), chapters=None, keep_size=False) -> bytearray:
+    """moov(mp4, ilst, padding, patches, chapters, keep_size) -> the rebuilt moov
+
+    The ilst is followed by padding bytes of free space.
+
+    patches are (file offset, bytes) to apply to the moov first.
+    chapters [(start seconds, title)] replace the Nero chapters (chpl) if given.
+    keep_size takes the space for the changes from the existing padding (if it is big enough) so the
+    moov keeps its size and can be written in place.
+    The chunk offsets are corrected for the size change if the moov is in front of the media data.
+    """
+    padding = ivonet.TAG_PADDING if padding is None else max(8, padding)
+    current = mp4.find("moov")
+    base = current.offset
+    data = bytearray(mp4.mm[current.offset:current.end])
+    for offset, patch in patches:
+        if current.offset <= offset < current.end:
+            data[offset - base:offset - base + len(patch)] = patch
+
+    old_ilst = mp4.find("moov/udta/meta/ilst")
+    meta = mp4.find("moov/udta/meta")
+    udta = mp4.find("moov/udta")
+    nero = chpl(chapters) if chapters else b""
+    old_chpl = mp4.find("moov/udta/chpl") if udta else None
+    edits = []  # (start, end, replacement, ancestors)
+    if old_ilst:
+        old_padding = _padding_after(old_ilst)
+        end = old_padding[-1].end if old_padding else old_ilst.end
+        if keep_size:
+            growth = len(nero) - (old_chpl.size if old_chpl else 0) if chapters is not None else 0
+            remaining = end - old_ilst.offset - len(new_ilst) - growth
+            if remaining >= 8:
+                padding = remaining
+        edits.append((old_ilst.offset, end, new_ilst + free(padding), [meta, udta, current]))
+    elif meta:
+        edits.append((meta.end, meta.end, new_ilst + free(padding), [meta, udta, current]))
+    elif udta:
+        edits.append((udta.end, udta.end, _meta(new_ilst, padding), [udta, current]))
+    else:
+        edits.append((current.end, current.end, atom("udta", _meta(new_ilst, padding), nero), [current]))
+    if udta and chapters is not None:
+        if old_chpl:
+            edits.append((old_chpl.offset, old_chpl.end, nero, [udta, current]))
+        else:
+            edits.append((udta.end, udta.end, nero, [udta, current]))
+    # from the back to the front so the offsets of the edits still to do stay valid
+    delta = 0
+    for start, end, replacement, ancestors in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        data[start - base:end - base] = replacement
+        _grow(data, base, ancestors, len(replacement) - (end - start))
+        delta += len(replacement) - (end - start)
+    if delta:
+        _shift_chunk_offsets(data, current.end, delta)
+    return data
+
+
+def write(filename: str, tags=None, cover=None, padding=None, chapters=None) -> bool:
+    """write(filename, tags, cover, padding, chapters) -> True if written in place, False if rewritten
+
+    tags is a dict like {"title": "...", "artist": "..."} (see TAGS), cover the image as bytes and
+    chapters [(start seconds, title)] for the Nero chapter list (taken from the padding if possible).
+    """
+    with Mp4(filename) as mp4:
+        new_ilst = ilst(mp4, tags, cover)
+        place = None if chapters is not None else _in_place(mp4, new_ilst)
+        moov_at_end = False
+        if not place and chapters is not None:
+            current = mp4.find("moov")
+            if current:
+                data = moov(mp4, new_ilst, chapters=chapters, keep_size=True)
+                if len(data) == current.size:
+                    place = current.offset, bytes(data)
+        if not place:
+            current = mp4.find("moov")
+            if not current:
+                raise ValueError(f"No moov atom in: {filename}")
+            data = moov(mp4, new_ilst, padding, chapters=chapters)
+            if current.end != len(mp4.mm):
+                _rewrite(mp4, filename, current, data)
+                return False
+            place = current.offset, bytes(data)
+            moov_at_end = True
+    offset, data = place
+    with open(filename, "r+b") as fo:
+        fo.seek(offset)
+        fo.write(data)
+        if moov_at_end:
+            fo.truncate()
+    return True
+
+
+def _rewrite(mp4: Mp4, filename: str, current, data: bytearray):
+    """Writes the file with the new moov to a temporary file and replaces the original with it"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temp = tempfile.mkstemp(prefix=".tags-", dir=directory)
+    try:
+        os.chmod(temp, os.stat(filename).st_mode & 0o7777)
+        with os.fdopen(handle, "wb") as fo:
+            _copy(mp4.mm, 0, current.offset, fo)
+            fo.write(data)
+            _copy(mp4.mm, current.end, len(mp4.mm), fo)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def _copy(mm, start: int, end: int, fo):
+    for pos in range(start, end, COPY_BUFFER):
+        fo.write(mm[pos:min(pos + COPY_BUFFER, end)])
+
+
+__all__ = [
+    "TAGS",
+    "chpl",
+    "ilst",
+    "item",
+    "moov",
+    "write",
+]
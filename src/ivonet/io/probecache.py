@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-22 20:05:48$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Persistent cache of the ffprobe results keyed by the identity of the file.
+
+The identity is (path, size, mtime, inode). When any of those changed the entry is stale
+and removed. Only complete probes (with the format and streams) are cached, so a failed
+probe is retried the next time instead of failing the same way until the file changes.
+The cache holds at most PROBE_CACHE_SIZE entries; the least recently used ones are evicted.
+It is an SQLite database in the settings directory in WAL mode, so many worker threads and
+processes can read it at the same time.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import ivonet
+
+TIMEOUT = 30  # seconds to wait for a lock held by another thread or process
+
+
+def _connect():
+    conn = sqlite3.connect(ivonet.PROBE_CACHE_DB, timeout=TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS probe (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        mtime INTEGER NOT NULL,
+                        inode INTEGER NOT NULL,
+                        checksum TEXT,
+                        duration REAL,
+                        chapters TEXT,
+                        probe TEXT NOT NULL,
+                        last_used REAL NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS probe_last_used ON probe (last_used)")
+    return conn
+
+
+def _identity(filename) -> tuple:
+    stat = os.stat(filename)
+    return os.path.realpath(filename), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def complete(probe) -> bool:
+    """complete(probe) -> True if the probe holds the format and streams of a successful ffprobe run"""
+    return isinstance(probe, dict) and "format" in probe and "streams" in probe
+
+
+def lookup(filename):
+    """lookup(filename) -> the cached probe of the file or None if not cached or the file changed"""
+    try:
+        path, size, mtime, inode = _identity(filename)
+    except OSError:
+        return None
+    with closing(_connect()) as conn, conn:
+        row = conn.execute("SELECT size, mtime, inode, probe FROM probe WHERE path = ?", (path,)).fetchone()
+        if not row:
+            return None
+        ret = json.loads(row[3])
+        if row[:3] != (size, mtime, inode) or not complete(ret):
+            conn.execute("DELETE FROM probe WHERE path = ?", (path,))
+            return None
+        conn.execute("UPDATE probe SET last_used = ? WHERE path = ?", (time.time(), path))
+    return ret
+
+
+def store(filename, probe: dict):
+    """store(filename, probe) -> caches the (complete) probe of the file and evicts the least recently used entries"""
+    if not complete(probe):
+        return
+    try:
+        path, size, mtime, inode = _identity(filename)
+    except OSError:
+        return
+    try:
+        duration = float(probe.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (path, size, mtime, inode, probe.get("checksum"), duration,
+                      json.dumps(probe.get("chapters", [])), json.dumps(probe), time.time()))
+        conn.execute("""DELETE FROM probe WHERE path NOT IN (
+                            SELECT path FROM probe ORDER BY last_used DESC LIMIT ?)""",
+                     (ivonet.PROBE_CACHE_SIZE,))
+
+
+__all__ = [
+    "complete",
+    "lookup",
+    "store",
+]
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-28 16:40:22$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+Bounded scheduler for the conversion jobs (AudiobookEntry's).
+
+At most max_jobs jobs run at the same time, the rest waits in the queue and is started
+when a running job is released (done, failed or cancelled).
+
+The stages of a running job stress different resources, so every stage takes a slot of its
+own resource pool while it runs (see pool()):
+- POOL_PROBE: probing and reading the headers (small random reads)
+- POOL_KEY: recovering the activation bytes (cpu and memory of the rainbow tables)
+- POOL_CONVERT: decrypting / remuxing / transcoding (sequential I/O or cpu)
+- POOL_TAG: cover extraction and tagging (small random I/O)
+This way one book is converted while the key of another is recovered and a third is tagged
+without any of the resources being oversubscribed.
+
+The queue is ordered on the priority of the jobs (higher first) and, with the SJF policy, on
+their expected cost (shortest first) so one very long book does not hold up a dozen short ones.
+The cost is the duration of the probe (when cached) or else estimated from the file size.
+Queued jobs can be moved by hand; they take over the priority of the jobs they pass.
+
+The pool sizes are based on the number of cpu's and on whether the storage holding the
+audiobooks is rotational (see /sys/block/<device>/queue/rotational); a spinning disk
+only gets one converting stream as parallel streams make it seek all the time.
+The books are read and written next to the aax, so the pools are tuned for the device of the
+first book submitted to an idle scheduler (the path attribute of the job).
+The cpu bound pools are divided by the number of workers a single stage already starts,
+so the running stages together never start more workers than there are cpu's.
+"""
+
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import ivonet
+from ivonet.events import dbg
+from ivonet.io import probecache
+
+POOL_PROBE = "probe"
+POOL_KEY = "key"
+POOL_CONVERT = "convert"
+POOL_TAG = "tag"
+ROTATIONAL_IO_SLOTS = 1
+RANDOM_IO_SLOTS = 4
+POLL_INTERVAL = 0.5
+POLICY_FIFO = "fifo"
+POLICY_SJF = "sjf"  # shortest expected job first
+POLICIES = [POLICY_FIFO, POLICY_SJF]
+AAX_BYTES_PER_SECOND = 64000 / 8  # Audible "enhanced" quality
+
+
+def rotational(path) -> bool:
+    """rotational(path) -> True if the file system of the path is on a spinning disk (Linux only)"""
+    try:
+        stat = os.stat(path)
+        device = os.path.realpath(f"/sys/dev/block/{os.major(stat.st_dev)}:{os.minor(stat.st_dev)}")
+    except (OSError, AttributeError):
+        return False
+    # a partition has no queue of its own, the disk it is part of (the parent) has
+    for directory in (device, os.path.dirname(device)):
+        try:
+            with open(os.path.join(directory, "queue", "rotational")) as fi:
+                return fi.read().strip() == "1"
+        except IOError:
+            continue
+    return False
+
+
+def default_pools(path=None) -> dict:
+    """default_pools(path) -> {pool name: slots} for audiobooks on the path"""
+    cpus = os.cpu_count() or 1
+    spinning = rotational(path or ivonet.DEFAULT_SAVE_PATH)
+    return {
+        POOL_PROBE: ROTATIONAL_IO_SLOTS if spinning else RANDOM_IO_SLOTS,
+        # one recovery already searches the rainbow tables with RAINBOW_CONCURRENCY processes
+        POOL_KEY: max(1, cpus // ivonet.RAINBOW_CONCURRENCY),
+        # one conversion already decrypts / transcodes with DECRYPT_CONCURRENCY / TRANSCODE_CONCURRENCY workers
+        POOL_CONVERT: ROTATIONAL_IO_SLOTS if spinning else max(1, cpus // max(ivonet.DECRYPT_CONCURRENCY,
+                                                                            ivonet.TRANSCODE_CONCURRENCY)),
+        POOL_TAG: ROTATIONAL_IO_SLOTS if spinning else RANDOM_IO_SLOTS,
+    }
+
+
+def default_max_jobs(path=None) -> int:
+    """default_max_jobs(path) -> the number of jobs to run at the same time: enough to keep all the pools busy"""
+    return sum(default_pools(path).values())
+
+
+def estimate_cost(filename) -> float:
+    """estimate_cost(filename) -> the expected work of converting the file as seconds of audio"""
+    try:
+        probe = probecache.lookup(filename)
+    except (sqlite3.Error, ValueError) as e:  # the cache is only a hint
+        dbg(e)
+        probe = None
+    try:
+        return float(probe["format"]["duration"])
+    except (TypeError, KeyError, ValueError):
+        pass
+    try:
+        return os.path.getsize(filename) / AAX_BYTES_PER_SECOND
+    except OSError:
+        return 0.0
+
+
+class Pool(object):
+    """A counting semaphore of which the number of slots can be changed while it is in use"""
+
+    def __init__(self, slots: int) -> None:
+        self.slots = slots
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None) -> bool:
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.used < self.slots, timeout):
+                return False
+            self.used += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.used -= 1
+            self.condition.notify()
+
+    def resize(self, slots: int):
+        """Changes the number of slots. Slots in use are kept when it gets smaller"""
+        with self.condition:
+            self.slots = slots
+            self.condition.notify_all()
+
+
+class JobScheduler(object):
+    """Starts the submitted jobs (objects with a start() method) with at most max_jobs running.
+
+    The jobs may have a priority (int, default 0), a cost (float, default 0) and a path
+    (the file the job works on) attribute.
+    """
+
+    def __init__(self, max_jobs=None, pools=None, policy=POLICY_FIFO) -> None:
+        self.policy = policy
+        pools = pools or default_pools()
+        # max_jobs follows the pools unless it is given (or set with resize())
+        self.auto_max_jobs = not max_jobs
+        self.max_jobs = max_jobs or sum(pools.values())
+        self.pools = {name: Pool(slots) for name, slots in pools.items()}
+        # the threads the running jobs do their work in
+        self.executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="job")
+        self.queued = []
+        self.running = []
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def pool(self, name: str, cancelled=None):
+        """pool(name, cancelled) -> context holding a slot of the resource pool while a stage runs.
+
+        Yields True when the slot is taken or False if cancelled returned True while waiting for it.
+        """
+        pool = self.pools.get(name)
+        if pool is None:
+            yield True
+            return
+        while not pool.acquire(timeout=POLL_INTERVAL):
+            if cancelled and cancelled():
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            pool.release()
+
+    def _key(self, job) -> tuple:
+        cost = getattr(job, "cost", 0) if self.policy == POLICY_SJF else 0
+        return -getattr(job, "priority", 0), cost
+
+    def submit(self, job):
+        """Queues the job behind the jobs that go first according to the policy and starts it if there is a free slot"""
+        with self.lock:
+            path = getattr(job, "path", None)
+            if path and not self.queued and not self.running:
+                self.tune(path)
+            key = self._key(job)
+            idx = len(self.queued)
+            while idx > 0 and key < self._key(self.queued[idx - 1]):
+                idx -= 1
+            self.queued.insert(idx, job)
+        self._start_next()
+
+    def set_policy(self, policy: str):
+        """Changes the ordering policy and reorders the queue (jobs that are equal keep their order)"""
+        with self.lock:
+            self.policy = policy
+            self.queued.sort(key=self._key)
+
+    def move(self, job, steps: int) -> bool:
+        """move(job, steps) -> True if the queued job moved steps places (negative is earlier)"""
+        with self.lock:
+            if job not in self.queued:
+                return False
+            idx = self.queued.index(job)
+            new_idx = max(0, min(len(self.queued) - 1, idx + steps))
+            if new_idx == idx:
+                return False
+            passed = self.queued[new_idx]
+            # take over the priority of the passed job so jobs queued later respect the new order
+            if new_idx < idx:
+                job.priority = max(getattr(job, "priority", 0), getattr(passed, "priority", 0))
+            else:
+                job.priority = min(getattr(job, "priority", 0), getattr(passed, "priority", 0))
+            self.queued.insert(new_idx, self.queued.pop(idx))
+            return True
+
+    def queue(self) -> list:
+        """queue() -> the queued jobs in the order they will be started"""
+        with self.lock:
+            return list(self.queued)
+
+    def release(self, job):
+        """The job is done, failed or cancelled; its slot (or place in the queue) is given free"""
+        with self.lock:
+            if job in self.running:
+                self.running.remove(job)
+            elif job in self.queued:
+                self.queued.remove(job)
+        self._start_next()
+
+    def is_queued(self, job) -> bool:
+        with self.lock:
+            return job in self.queued
+
+    def resize(self, max_jobs: int):
+        """Changes the maximum number of running jobs. Running jobs are not stopped when it gets smaller"""
+        with self.lock:
+            self.auto_max_jobs = False
+            self._set_max_jobs(max_jobs)
+        self._start_next()
+
+    def tune(self, path):
+        """Sizes the resource pools (and max_jobs if not set by hand) for the storage holding the path"""
+        pools = default_pools(path)
+        with self.lock:
+            for name, slots in pools.items():
+                if name in self.pools:
+                    self.pools[name].resize(slots)
+                else:
+                    self.pools[name] = Pool(slots)
+            if self.auto_max_jobs:
+                self._set_max_jobs(sum(pools.values()))
+        dbg(f"Resource pools for [{path}]: {pools}")
+
+    def _set_max_jobs(self, max_jobs: int):
+        if max_jobs > self.max_jobs:
+            # the running jobs finish in the old executor
+            self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="job")
+        self.max_jobs = max(1, max_jobs)
+
+    def shutdown(self):
+        """Forgets the queued jobs and cancels the runs that have not started yet.
+
+        The running jobs must be stopped by the caller, the interpreter waits for their threads at exit.
+        """
+        with self.lock:
+            self.queued.clear()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _start_next(self):
+        while True:
+            with self.lock:
+                if not self.queued or len(self.running) >= self.max_jobs:
+                    return
+                job = self.queued.pop(0)
+                self.running.append(job)
+            dbg(f"Starting job ({len(self.running)}/{self.max_jobs} running, {len(self.queued)} queued)")
+            job.start()
+
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+__author__ = "Ivo Woltring"
+__revised__ = "$revised: 2021-03-29 20:15:37$"
+__copyright__ = "Copyright (c) 2021 Ivo Woltring"
+__license__ = "Apache 2.0"
+__doc__ = """
+One reactor (a selectors loop in a single thread) reading the output of all the child processes
+(rcrack, ffmpeg, ...) of all the running jobs.
+
+The pipes are read in binary chunks and split in lines on \\n and \\r (ffmpeg ends its progress
+lines with \\r) without decoding them. Every complete line is handed to the callback of the job
+that owns the process, so no job needs a thread blocked in readline() anymore.
+
+Example:
+    done = ProcessReactor.instance().watch(process, on_line)
+    done.wait()  # set when the process closed its output
+"""
+
+import os
+import selectors
+import threading
+
+from ivonet.events import dbg
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Watch(object):
+    """The output of one process: the incomplete last line and where the lines go"""
+
+    def __init__(self, process, on_line=None) -> None:
+        self.process = process
+        self.fd = process.stdout.fileno()
+        self.on_line = on_line
+        self.buffer = b""
+        self.done = threading.Event()
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        end = max(self.buffer.rfind(b"\n"), self.buffer.rfind(b"\r"))
+        if end < 0:
+            return
+        lines, self.buffer = self.buffer[:end + 1], self.buffer[end + 1:]
+        for line in lines.splitlines():
+            self.dispatch(line)
+
+    def close(self):
+        if self.buffer:
+            self.dispatch(self.buffer)
+            self.buffer = b""
+        self.done.set()
+
+    def dispatch(self, line: bytes):
+        if not line or self.on_line is None:
+            return
+        try:
+            self.on_line(line)
+        except Exception as e:  # a bad callback must not stop the reactor for all the other jobs
+            dbg(f"Output handler failed: {e!r}")
+
+
+class ProcessReactor(object):
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """instance() -> the reactor of the application (started on first use)"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.loop, name="ProcessReactor", daemon=True)
+        self.thread.start()
+
+    def watch(self, process, on_line=None) -> threading.Event:
+        """watch(process, on_line) -> event set when the process closed its (binary) stdout
+
+        on_line(bytes) is called in the reactor thread for every line of output.
+        The stdout must not be read by anyone else and is not closed by the reactor.
+        """
+        watch = Watch(process, on_line)
+        with self.lock:
+            self.pending.append(watch)
+        os.write(self.wakeup_write, b"\0")
+        return watch.done
+
+    def loop(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    self._register_pending()
+                else:
+                    self._read(key)
+
+    def _register_pending(self):
+        try:
+            while os.read(self.wakeup_read, CHUNK_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for watch in pending:
+            self.selector.register(watch.fd, selectors.EVENT_READ, watch)
+
+    def _read(self, key):
+        watch = key.data
+        try:
+            data = os.read(key.fd, CHUNK_SIZE)
+        except OSError:
+            data = b""
+        if data:
+            watch.feed(data)
+            return
+        self.selector.unregister(key.fd)
+        watch.close()
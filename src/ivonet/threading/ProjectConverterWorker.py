@@ -8,305 +8,565 @@ __doc__ = """
 
 """
 
-import _thread
 import os
-import re
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 
 import wx
 import wx.lib.newevent
 
 import ivonet
+from ivonet.drm import activation, aax, bruteforce, daemon, rainbow, recovery
 from ivonet.events import dbg, log
 from ivonet.events.custom import ProcessDoneEvent, ProcessExceptionEvent
-from ivonet.io import ffprobe
+from ivonet.io import adrm, adts, cover, decrypt, ffprobe
+from ivonet.threading.JobScheduler import POOL_CONVERT, POOL_KEY, POOL_PROBE, POOL_TAG
+from ivonet.threading.ProcessReactor import ProcessReactor
 
-
-def time_seconds(seq) -> int:
-    """ Calculates the time in seconds based on hours, minutes, seconds.
-    The milliseconds are ignored. That kind of accuracy is not needed
-    :param seq: (hours, minutes, seconds, [milliseconds])
-    :return: int of seconds
-    """
-    return int(seq[0]) * 3600 + int(seq[1]) * 60 + int(seq[2])
+TERMINATE_DEADLINE = 3  # seconds a child process gets to stop after SIGTERM before it is killed
 
 
 class ProjectConverterWorker(object):
-    DURATION = re.compile(".*Duration: ([0-9]{2}):([0-9]{2}):([0-9]{2}).([0-9]{2}).*")
-    TIME_ELAPSED = re.compile(".*size=.*time=([0-9]{2}):([0-9]{2}):([0-9]{2}).([0-9]{2}).*")
 
-    def __init__(self, parent, project) -> None:
+    def __init__(self, parent, project, mode=ivonet.DEFAULT_CONVERSION_MODE, scheduler=None) -> None:
         self.parent = parent
         self.project = project
+        self.mode = mode
+        self.scheduler = scheduler
         self.base_dir, self.filename = os.path.split(self.project)
         self.audiobook_name = os.path.splitext(self.filename)[0]
-        self.m4a = os.path.join(self.base_dir, self.audiobook_name + ".m4a")
         self.m4b = os.path.join(self.base_dir, self.audiobook_name + ".m4b")
         self.cover = os.path.join(self.base_dir, self.audiobook_name + ".jpg")
         self.keep_going = False
         self.running = False
         self.pid = None
-        self.total_duration = 0
+        self.total_duration = 0  # microseconds of audio to convert (from the probe)
         self.progress = 0
+        self.stats = {}  # the last ffmpeg -progress report: out_time_us, total_size, speed
         self.process = None
+        self.child_processes = []
+        self.child_lock = threading.Lock()
+        self.future = None
+        self.partial_files = set()  # output written by this run, removed if it does not finish
+        self.completed = False
 
-    def calc_percentage_done(self, seq):
-        return int(time_seconds(seq) * 100 / self.total_duration)
+    def calc_percentage_done(self, out_time_us: int) -> int:
+        if self.total_duration <= 0:
+            return 0
+        return max(0, min(100, int(out_time_us * 100 / self.total_duration)))
 
     def start(self):
         self.keep_going = self.running = True
-        _thread.start_new_thread(self.run, ())
+        if self.scheduler:
+            self.future = self.scheduler.executor.submit(self.run)
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
+            self.future = executor.submit(self.run)
+            executor.shutdown(wait=False)
+        self.future.add_done_callback(self.on_finished)
 
     def stop(self):
+        """Stops the conversion right away.
+
+        The child processes get SIGTERM and are killed if they are still running after
+        TERMINATE_DEADLINE seconds. The partial output is removed when the run has stopped.
+        """
         self.keep_going = False
+        if self.future:
+            self.future.cancel()
+        self.terminate_child_processes()
+
+    def on_finished(self, future):
+        """Called in the worker thread when the run is over (or cancelled before it started)"""
+        self.running = False
+        try:
+            error = future.exception()
+        except CancelledError:
+            error = None
+        if error:
+            log(f"Conversion of [{self.project}] failed: {error!r}")
+            wx.PostEvent(self.parent, ProcessExceptionEvent(msg=str(error), project=self.project))
+        if not self.completed:
+            self.remove_partial_files()
+
+    def remove_partial_files(self):
+        for filename in self.partial_files:
+            try:
+                os.remove(filename)
+                dbg(f"Removed partial file: {filename}")
+            except OSError:
+                pass
+        self.partial_files.clear()
 
     def is_running(self) -> bool:
         return self.running
 
     def run(self):
         self.running = True
-        log(f"Creating: {self.m4b}")
+        log(f"Creating: {self.m4b} ({self.mode})")
 
         self.parent.stage = 1
-        checksum = ffprobe.checksum(self.project)
+        with self.pool(POOL_PROBE) as acquired:
+            if not acquired:
+                self.running = False
+                return
+            try:
+                metadata = ffprobe.probe(self.project)
+            except IOError as e:
+                wx.PostEvent(self.parent, ProcessExceptionEvent(msg=str(e), project=self.project))
+                return
+            checksum = adrm.checksum(self.project) or metadata["checksum"]
         log(f"Checksum for [{self.project}] is [{checksum}]")
         if not checksum:
             wx.PostEvent(self.parent, ProcessExceptionEvent(msg="No checksum retrieved.", project=self.project))
             return
+        # the cover is read from the aax itself so it does not need to wait for the conversion
+        cover_extraction = threading.Thread(target=self.extract_cover, daemon=True)
+        cover_extraction.start()
 
-        self.parent.stage = 2
-        activation_bytes = self.get_activation_bytes(checksum)
-        log(f"Activation bytes for [{self.project}] are [{activation_bytes}]")
-        if not activation_bytes:
-            wx.PostEvent(self.parent, ProcessExceptionEvent(msg="No activation bites found.", project=self.project))
-            return
-
-        if not self.keep_going:
-            self.running = False
-            return
-
-        self.parent.stage = 3
-        metadata = ffprobe.metadata(self.project)
-
-        if not self.keep_going:
-            self.running = False
-            return
-
-        self.parent.stage = 4
-        self.convert_2_m4a(activation_bytes)
-
-        if not self.keep_going:
-            self.running = False
-            return
-
-        self.parent.stage = 5
-        self.add_metadata(metadata)
-
-        if not self.keep_going:
-            self.running = False
-            return
-
-        self.parent.stage = 7
-        self.extract_cover()
-
-        if not self.keep_going:
-            self.running = False
-            return
+        try:
+            self.parent.stage = 2
+            with self.pool(POOL_KEY) as acquired:
+                activation_bytes = self.get_activation_bytes(checksum) if acquired else None
+            if not self.keep_going:
+                self.running = False
+                return
+            log(f"Activation bytes for [{self.project}] are [{activation_bytes}]")
+            if not activation_bytes:
+                wx.PostEvent(self.parent, ProcessExceptionEvent(msg="No activation bites found.", project=self.project))
+                return
+
+            self.parent.stage = 3
+            # the metadata has already been probed together with the checksum in stage 1
+            self.parent.update(100)
 
-        self.parent.stage = 8
-        self.add_cover_art()
+            if not self.keep_going:
+                self.running = False
+                return
 
-        self.cleanup()
+            self.parent.stage = 4
+            with self.pool(POOL_CONVERT) as acquired:
+                if acquired:
+                    self.partial_files.add(self.m4b)
+                    self.convert(activation_bytes, metadata)
+        finally:
+            # the cover must be written before on_finished removes the partial files
+            cover_extraction.join()
 
         if self.keep_going:
+            self.completed = True
             self.parent.update(100)
             wx.PostEvent(self.parent, ProcessDoneEvent())
         self.running = False
         self.keep_going = False
         log(f"Created: {self.m4b}")
 
+    def convert(self, activation_bytes, metadata):
+        """Creates the m4b the fastest way possible for the conversion mode"""
+        if self.mode == ivonet.CONVERSION_MODE_TRANSCODE and ivonet.TRANSCODE_CONCURRENCY > 1 \
+                and len(metadata.get("chapters", [])) > 1:
+            self.transcode_segmented(activation_bytes, metadata)
+        elif self.mode == ivonet.CONVERSION_MODE_REMUX and aax.can_decrypt():
+            self.decrypt_2_m4b(activation_bytes, metadata)
+        else:
+            self.convert_2_m4b(activation_bytes, metadata)
+
+    def pool(self, name):
+        """pool(name) -> context holding a slot of the named resource pool of the scheduler (if any)"""
+        if self.scheduler is None:
+            return nullcontext(True)
+        return self.scheduler.pool(name, lambda: not self.keep_going)
+
     def get_activation_bytes(self, checksum):
+        ret = activation.lookup(checksum)
+        if ret:
+            dbg(f"Activation bytes for checksum [{checksum}] found in cache")
+            self.parent.update(100)
+            return ret
+        ret = aax.find(checksum, activation.history())
+        if ret:
+            dbg(f"Activation bytes for checksum [{checksum}] verified against known activation bytes")
+            activation.store(checksum, ret)
+            self.parent.update(100)
+            return ret
+        ret = recovery.recover(checksum, self.recover_activation_bytes, lambda: not self.keep_going)
+        if ret:
+            activation.store(checksum, ret)
+            self.parent.update(100)
+        # keep_going stays set when nothing was found, so run() can tell that apart from a cancel
+        return ret
+
+    def recover_activation_bytes(self, checksum):
+        """recover_activation_bytes(checksum) -> activation bytes or None
+
+        Searches the rainbow tables with rcrack. Only when rcrack can not be run the rainbow table
+        daemon is asked (if it is running), as its in process engine is a lot slower than rcrack,
+        and the remaining tables are searched here.
+        Brute forces the key space as a last resort when BRUTE_FORCE is set.
+        """
         ret = None
-        for idx, rt_file in enumerate(ivonet.RAINBOW_FILES, 1):
-            self.parent.update(idx * (100 / len(ivonet.RAINBOW_FILES)))
-            ret = self.activation_bytes(rt_file, checksum)
-            if ret:
-                self.parent.update(100)
-                return ret
-        if not ret:
-            self.keep_going = False
+        rt_files = ivonet.RAINBOW_FILES
+        if not self.can_run_rcrack() and daemon.available():
+            try:
+                log(f"Rainbow table daemon lookup: {self.project}")
+                ret = daemon.lookup(checksum, lambda: not self.keep_going)
+                # the daemon has searched all the tables it serves
+                rt_files = [rt_file for rt_file in rt_files if rt_file not in daemon.rt_files()]
+            except OSError as e:
+                # the tables of the daemon have not been searched so all the tables are searched here
+                log(f"Rainbow table daemon lookup failed, searching all the tables: {e}")
+        if not ret and self.keep_going:
+            ret = self.rainbow_search(checksum, rt_files)
+        if not ret and self.keep_going and ivonet.BRUTE_FORCE:
+            log(f"No rainbow table match. Brute forcing the activation bytes for: {self.project}")
+            ret = bruteforce.search(checksum, self.parent.update, lambda: not self.keep_going)
         return ret
 
-    def activation_bytes(self, rt_file, checksum):
-        cmd = [ivonet.APP_RCRACK, rt_file, "-h", checksum]
-        dbg(cmd)
+    @staticmethod
+    def can_run_rcrack() -> bool:
+        return os.access(ivonet.APP_RCRACK, os.X_OK)
 
-        self.subprocess(cmd)
+    def rainbow_search(self, checksum, rt_files):
+        """rainbow_search(checksum, rt_files) -> activation bytes or None
 
-        log(f"RainbowCrack: {self.project}")
+        Searches all the rainbow tables at the same time (bounded by RAINBOW_CONCURRENCY).
+        The first table with a hit wins and all the other rcrack processes are killed.
+        """
+        found = threading.Event()
+        searched = 0
         ret = None
-        while self.keep_going:
-            try:
-                line = self.process.stdout.readline()
-            except UnicodeDecodeError:
-                continue
-            dbg(line)
-            if not line:
-                dbg(f"Finished Merge for: {self.project}")
-                break
-            if "hex:" in line:
-                ret = line.split("hex:")[1]
-                if not ret or "notfound" in ret:
-                    ret = None
-        self.__check_process(cmd)
-        self.parent.update(100)
-        return ret.strip()
+        with ThreadPoolExecutor(max_workers=ivonet.RAINBOW_CONCURRENCY) as executor:
+            futures = [executor.submit(self.activation_bytes, rt_file, checksum, found)
+                       for rt_file in rt_files]
+            for future in as_completed(futures):
+                searched += 1
+                self.parent.update(searched * 100 / len(futures))
+                ret = future.result()
+                if ret:
+                    found.set()
+                    for pending in futures:
+                        pending.cancel()
+                    self.kill_child_processes()
+                    break
+        return ret
 
-    def convert_2_m4a(self, activation_bytes):
-        cmd = [ivonet.APP_FFMPEG,
-               "-activation_bytes", activation_bytes,
-               '-i',
-               self.project,
-               "-stats",
-               "-y",
-               "-vn",
-               "-c:a", "copy",
-               "-acodec", "aac",
-               "-movflags", "use_metadata_tags",
-               "-map_metadata", "0",
-               "-map_metadata:s:a", "0:s:a",
-               self.m4a,
-               ]
-        dbg(cmd)
-        self.subprocess(cmd)
+    def activation_bytes(self, rt_file, checksum, found=None):
+        """activation_bytes(rt_file, checksum, found) -> searches one rainbow table.
 
-        log(f"Conversion has started for: {self.project}")
-        while self.keep_going:
+        The table is searched with rcrack. Only when rcrack can not be run the table is searched
+        in process (if supported), as that is a lot slower than rcrack.
+        Stops searching as soon as the found event is set by another table search.
+        """
+        found = found or threading.Event()
+        if not self.can_run_rcrack() and rainbow.supports(rt_file):
             try:
-                line = self.process.stdout.readline()
-            except UnicodeDecodeError:
-                #  just skip a line
-                continue
-            if not line:
-                dbg(f"Conversion finished for: {self.project}")
-                break
-            dbg(line)
-            duration = self.DURATION.match(line)
-            if duration:
-                self.total_duration = time_seconds(duration.groups())
-                continue
-            elapsed = self.TIME_ELAPSED.match(line)
-            if elapsed:
-                self.progress = self.calc_percentage_done(elapsed.groups())
-                self.parent.update(self.progress)
-        self.__check_process(cmd)
+                log(f"Rainbow table lookup [{os.path.basename(rt_file)}]: {self.project}")
+                return rainbow.lookup(checksum, [rt_file], lambda: found.is_set() or not self.keep_going)
+            except (IOError, ValueError) as e:
+                dbg(f"In process rainbow table lookup failed, trying rcrack anyway: {e}")
+        cmd = [ivonet.APP_RCRACK, rt_file, "-h", checksum]
+        with self.child_lock:
+            if found.is_set() or not self.keep_going:
+                return None
+            dbg(cmd)
+            process = self.spawn(cmd)
+            self.child_processes.append(process)
 
-    def add_metadata(self, metadata):
-        """AtomicParsley "${AUDIOBOOK}.m4a" --title "${TITLE}"
-        --grouping "${GROUPING}" --sortOrder album "${GROUPING}"
-        --album "${ALBUM}" --artist "${AUTHOR}" --genre "${GENRE}"
-        --tracknum "${TRACK}" --disk "${TRACK}" --comment "${COMMENT}"
-        --year "${YEAR}" --stik Audiobook --overWrite"""
-        tags = metadata["format"]["tags"]
-        cmd = [
-            ivonet.APP_ATOMIC_PARSLEY,
-            self.m4a,
-            "--title", f"{tags['title']}",
-            "--album", f"{tags['album']}",
-            "--artist", f"{tags['artist']}",
-            "--genre", f"{tags['genre']}",
-            "--comment", f"""{tags['comment']}""",
-            "--year", f"{tags['date']}",
-            "--encodingTool", f"{ivonet.TXT_APP_NAME} ({ivonet.TXT_APP_TINY_URL})",
-            "--stik", "Audiobook",
-            "--overWrite"
-        ]
-        dbg(cmd)
-        self.subprocess(cmd)
+        log(f"RainbowCrack [{os.path.basename(rt_file)}]: {self.project}")
+        found_bytes = []
 
-        log(f"Adding metadata to: {self.project}")
-        while self.keep_going:
-            try:
-                line = self.process.stdout.readline()
-            except UnicodeDecodeError:
-                #  just skip a line
-                continue
-            if not line:
-                dbg(f"Finished Adding metadata to {self.project}")
-                break
+        def on_line(line: bytes):
             dbg(line)
-            if "Progress:" in line:
-                ret = line.split("%")
-                if len(ret) > 1:
-                    try:
-                        percentage = int(ret[0].split()[-1])
-                        self.parent.update(percentage)
-                        dbg(percentage)
-                    except (IndexError, ValueError):
-                        # Just ignore... probably bad line
-                        pass
-        self.parent.update(100)
-        self.__check_process(cmd)
+            if b"hex:" in line:
+                value = line.split(b"hex:")[1].strip()
+                if value and b"notfound" not in value:
+                    found_bytes.append(value.decode("ascii", "replace"))
+
+        try:
+            # a hit in another table or a stop kills the process, which ends the output
+            ProcessReactor.instance().watch(process, on_line).wait()
+            dbg(f"Finished RainbowCrack [{os.path.basename(rt_file)}] for: {self.project}")
+        finally:
+            with self.child_lock:
+                self.child_processes.remove(process)
+            if process.poll() is None:
+                process.terminate()
+            process.stdout.close()
+            process.wait()
+        return found_bytes[-1] if found_bytes and self.keep_going else None
 
     def extract_cover(self):
-        dbg("Extracting cover...")
-        ret = subprocess.getstatusoutput(f'ffmpeg -i "{self.project}" -y -v quiet -an -vcodec copy "{self.cover}"')
-        if ret[0] != 0:
-            self.keep_going = False
+        with self.pool(POOL_TAG) as acquired:
+            if not acquired:
+                return
+            dbg("Extracting cover...")
+            self.partial_files.add(self.cover)
+            try:
+                if not cover.extract(self.project, self.cover):
+                    log(f"No cover found in: {self.project}")
+            except (IOError, ValueError) as e:
+                log(f"Could not extract the cover of [{self.project}] ({e})")
+
+    def terminate_child_processes(self):
+        """Sends SIGTERM to the child processes and SIGKILL to the ones still running after TERMINATE_DEADLINE"""
+        with self.child_lock:
+            processes = [process for process in self.child_processes if process.poll() is None]
+        for process in processes:
+            process.terminate()
+        if processes:
+            timer = threading.Timer(TERMINATE_DEADLINE, self.kill_processes, (processes,))
+            timer.daemon = True
+            timer.start()
+
+    def kill_child_processes(self):
+        with self.child_lock:
+            processes = list(self.child_processes)
+        self.kill_processes(processes)
+
+    @staticmethod
+    def kill_processes(processes):
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    def decrypt_2_m4b(self, activation_bytes, metadata):
+        """Decrypts the aax in process straight into the m4b (see ivonet.io.decrypt).
+
+        The layout of the aax is kept as is, so the tags, cover and QuickTime chapter track come along.
+        The audiobook tags are added with free padding behind them for later in place changes and
+        the probed chapters are added as Nero chapters as well.
+        Falls back to ffmpeg if the aax can not be decrypted natively.
+        """
+        log(f"Decryption has started for: {self.project}")
+        try:
+            decrypt.decrypt(self.project, self.m4b, activation_bytes, self.parent.update,
+                            lambda: not self.keep_going, tags=self.tags(metadata),
+                            chapters=self.chapters(metadata))
+        except (IOError, ValueError) as e:
+            log(f"Native decryption failed for [{self.project}] ({e}). Falling back to ffmpeg.")
+            self.convert_2_m4b(activation_bytes, metadata)
+
+    def convert_2_m4b(self, activation_bytes, metadata, audio=None):
+        """Converts the aax to the final m4b in one ffmpeg run.
+
+        Decrypts the audio and copies (remux) or re-encodes (transcode) it depending on the
+        conversion mode. Maps the tags, the cover (attached picture) and the chapters of the aax
+        and adds the audiobook specific tags.
+        If audio (an already transcoded ADTS file) is given that audio is used instead of the aax audio.
+        Its priming frame gets a negative timestamp, so the muxer writes an edit list that skips it.
+        """
+        source = "1" if audio else "0"
+        cmd = [ivonet.APP_FFMPEG]
+        if audio:
+            priming = adts.PRIMING_FRAMES * adts.SAMPLES_PER_FRAME / self.sample_rate(metadata)
+            cmd += ["-itsoffset", f"-{priming:.6f}", "-i", audio]
+        cmd += ["-activation_bytes", activation_bytes,
+                '-i',
+                self.project,
+                "-nostats",
+                "-progress", "pipe:1",
+                "-y",
+                "-map", "0:a",
+                "-map", f"{source}:v?",
+                "-c", "copy",
+                *(["-bsf:a", "aac_adtstoasc"] if audio else self.audio_codec()),
+                "-disposition:v", "attached_pic",
+                "-map_metadata", source,
+                "-map_metadata:s:a", f"{source}:s:a",
+                "-map_chapters", source,  # written as QuickTime chapter track and Nero chpl
+                ]
+        for name, value in self.tags(metadata).items():
+            cmd += ["-metadata", f"{name}={value}"]
+        cmd.append(self.m4b)
+        dbg(cmd)
+        if not self.subprocess(cmd):
+            return
 
-    def add_cover_art(self):
-        self.parent.update(10)
-        cmd = [ivonet.APP_MP4_ART, "--add", self.cover, self.m4b]
+        try:
+            self.total_duration = int(float(metadata["format"]["duration"]) * 1000000)
+        except (KeyError, TypeError, ValueError):
+            self.total_duration = 0
+        self.stats = {}
+        log(f"Conversion ({self.mode}) has started for: {self.project}")
+        ProcessReactor.instance().watch(self.process, self.on_ffmpeg_output).wait()
+        dbg(f"Conversion finished for: {self.project}")
+        self.__check_process(cmd)
 
-        self.subprocess(cmd)
+    def on_ffmpeg_output(self, line: bytes):
+        """Called by the reactor for every line of ffmpeg output.
 
-        log(f"Adding Cover Art to: {self.project}")
-        while self.keep_going:
-            try:
-                line = self.process.stdout.readline()
-            except UnicodeDecodeError:
-                #  just skip a line.
-                continue
-            if not line:
-                dbg(f"Finished Adding CoverArt to: {self.project}")
-                break
+        The progress comes as key=value lines (-progress pipe:1) in blocks ending with progress=continue
+        or progress=end. Everything else (errors on stderr) is only logged.
+        """
+        key, separator, value = line.partition(b"=")
+        if not separator:
             dbg(line)
-            if "adding" in line:
-                self.parent.update(50)
-        self.__check_process(cmd)
-        self.parent.update(100)
-
-    def cleanup(self):
+            return
+        key = key.strip()
+        if key in (b"out_time_us", b"out_time_ms", b"total_size"):
+            # out_time_ms is (despite the name) also in microseconds
+            try:
+                self.stats[key.decode()] = int(value)
+            except ValueError:  # N/A at the start
+                pass
+        elif key == b"speed":
+            try:
+                self.stats["speed"] = float(value.strip().rstrip(b"x"))
+            except ValueError:
+                pass
+        elif key == b"progress":
+            out_time_us = self.stats.get("out_time_us", self.stats.get("out_time_ms", 0))
+            self.progress = self.calc_percentage_done(out_time_us)
+            self.parent.update(self.progress)
+            if value.strip() == b"end":
+                log(f"Wrote {self.stats.get('total_size', 0) / 1048576:.1f}MB at "
+                    f"{self.stats.get('speed', 0):.1f}x realtime: {self.project}")
+
+    def transcode_segmented(self, activation_bytes, metadata):
+        """Transcodes the book in segments split on the chapter boundaries in parallel.
+
+        The segments are encoded as ADTS by up to TRANSCODE_CONCURRENCY ffmpeg processes with a few
+        frames of overlap, joined on frame level (see ivonet.io.adts) and muxed with the tags, cover
+        and chapters into the m4b. Segment boundaries are rounded to AAC frames.
+        """
+        sample_rate = self.sample_rate(metadata)
+        frame = adts.SAMPLES_PER_FRAME
+        starts = sorted({round(float(chapter["start_time"]) * sample_rate / frame) * frame
+                         for chapter in metadata["chapters"]} | {0})
+        log(f"Transcoding {len(starts)} segments for: {self.project}")
+        with tempfile.TemporaryDirectory(prefix=".aax2m4b-", dir=self.base_dir) as tmp:
+            segments = [os.path.join(tmp, f"{idx:04d}.aac") for idx in range(len(starts))]
+            done = 0
+            with ThreadPoolExecutor(max_workers=ivonet.TRANSCODE_CONCURRENCY) as executor:
+                futures = [executor.submit(self.transcode_segment, activation_bytes,
+                                           start / sample_rate, (end - start) / sample_rate if end else None, segment)
+                           for (start, end), segment in zip(adts.bounds(starts), segments)]
+                for future in as_completed(futures):
+                    done += 1
+                    self.parent.update(done * 100 / len(futures))
+                    if not future.result():
+                        for pending in futures:
+                            pending.cancel()
+                        if self.keep_going:
+                            self.keep_going = False
+                            wx.PostEvent(self.parent, ProcessExceptionEvent(project=self.project,
+                                                                            msg="Transcoding a segment went wrong"))
+                        self.kill_child_processes()
+                        break
+            if not self.keep_going:
+                return
+            combined = os.path.join(tmp, "combined.aac")
+            adts.concat([(segment, *adts.keep(starts, idx)) for idx, segment in enumerate(segments)], combined)
+            self.convert_2_m4b(activation_bytes, metadata, combined)
+
+    def transcode_segment(self, activation_bytes, start, duration, segment) -> bool:
+        """transcode_segment(...) -> True if the segment of the aax was encoded to ADTS successfully"""
+        cmd = [ivonet.APP_FFMPEG,
+               "-v", "error",
+               "-y",
+               "-activation_bytes", activation_bytes,
+               "-ss", f"{start:.6f}",
+               "-i", self.project,
+               *(["-t", f"{duration:.6f}"] if duration else []),
+               "-map", "0:a",
+               "-c:a", "aac",
+               "-b:a", ivonet.TRANSCODE_BITRATE,
+               "-threads", "1",
+               "-f", "adts",
+               segment,
+               ]
+        with self.child_lock:
+            if not self.keep_going:
+                return False
+            dbg(cmd)
+            process = self.spawn(cmd)
+            self.child_processes.append(process)
+        output = []
         try:
-            os.remove(self.m4a)
-        except IOError:
-            pass
+            ProcessReactor.instance().watch(process, output.append).wait()
+            process.wait()
+        finally:
+            with self.child_lock:
+                self.child_processes.remove(process)
+            process.stdout.close()
+        if process.returncode != 0:
+            dbg(f"Segment transcoding failed ({process.returncode}): {b' '.join(output)}")
+        return process.returncode == 0
+
+    @staticmethod
+    def sample_rate(metadata) -> int:
+        audio = next(stream for stream in metadata["streams"] if stream.get("codec_type") == "audio")
+        return int(audio["sample_rate"])
+
+    def tags(self, metadata) -> dict:
+        """The audiobook tags of the m4b as ffmpeg metadata names (see ivonet.io.mp4tags.TAGS)"""
+        tags = metadata["format"].get("tags", {})
+        return {
+            "title": tags.get("title", self.audiobook_name),
+            "album": tags.get("album", ""),
+            "artist": tags.get("artist", ""),
+            "genre": tags.get("genre", ""),
+            "comment": tags.get("comment", ""),
+            "date": tags.get("date", ""),
+            "encoding_tool": f"{ivonet.TXT_APP_NAME} ({ivonet.TXT_APP_TINY_URL})",
+            "media_type": "2",  # stik Audiobook
+        }
+
+    @staticmethod
+    def chapters(metadata) -> list:
+        """The probed chapters as [(start seconds, title)]"""
+        return [(float(chapter["start_time"]), chapter.get("tags", {}).get("title", f"Chapter {idx + 1}"))
+                for idx, chapter in enumerate(metadata.get("chapters", []))]
+
+    def audio_codec(self) -> list:
+        """audio_codec() -> the ffmpeg audio codec options for the conversion mode"""
+        if self.mode == ivonet.CONVERSION_MODE_TRANSCODE:
+            return ["-c:a", "aac", "-b:a", ivonet.TRANSCODE_BITRATE]
+        return ["-c:a", "copy"]
 
     def subprocess(self, cmd: list):
-        """subprocess(command_list) -> perfors a system command.
+        """subprocess(command_list) -> the started process or None if the conversion has been stopped.
 
         Runs a subprocess with the stderr piped to stdout.
         The input stream (stdin) is closed right after startup. The process does not need it.
+        The process is a child process of this worker, so it is terminated when the worker is stopped.
         """
-        if not self.keep_going:
-            self.running = False
-            return
-        self.process = subprocess.Popen(
+        with self.child_lock:
+            if not self.keep_going:
+                self.running = False
+                return None
+            self.process = self.spawn(cmd)
+            self.child_processes.append(self.process)
+        return self.process
+
+    @staticmethod
+    def spawn(cmd: list):
+        """spawn(command_list) -> the started process with stderr piped to stdout (binary) and stdin closed
+
+        The output is meant to be read by the ProcessReactor.
+        """
+        process = subprocess.Popen(
             cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             shell=False,
-            universal_newlines=True,
+            bufsize=0,
         )
         # Close stdin as it is not used
-        self.process.stdin.close()
+        process.stdin.close()
+        return process
 
     def __check_process(self, cmd):
         if self.process and not self.keep_going:
             self.process.terminate()
         self.process.stdout.close()
         self.process.wait()
+        with self.child_lock:
+            self.child_processes.remove(self.process)
         if self.process.returncode != 0 and self.keep_going:
             # Only throw an exception if the process terminated wrong
             # but we wanted to keep going